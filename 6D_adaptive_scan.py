@@ -0,0 +1,45 @@
+from multiprocessing import Pool
+import numpy as np
+from kinetics_prop import KineticsProp
+from adaptive_scan import AdaptiveScan
+from scan_settings import KINETIC_PARAMS, grid
+import spectra
+
+if __name__ == '__main__':
+
+    ##############################################################################
+    #                                                                            #
+    #                               DEFINING GRIDS                               #
+    #                                                                            #
+    ##############################################################################
+
+    # resolution reached around the promising regions
+    params = grid(11)
+
+    ##############################################################################
+    #                                                                            #
+    #                           DEFINING KINETIC PARAMETERS                      #
+    #                                                                            #
+    ##############################################################################
+
+    kinetic_params = dict(KINETIC_PARAMS)
+
+    # the scan starts from the 3 x ... x 3 subgrid and halves the cells with high populations
+    # (or high variations of the population) down to the spacing of the full grid
+    scan = AdaptiveScan(
+        params=params,
+        kinetic_params=kinetic_params,
+        coarse_points=3,
+        refine_fraction=0.1,
+        chunk_size=kinetic_params['batch_size'],
+    )
+
+    scan.run(
+        KineticsProp(**kinetic_params).sweep,
+        pool=Pool(4, initializer=spectra.install, initargs=(spectra.load(),)),
+    )
+
+    print('%d of %d grid points evaluated in %g s' % (len(scan), np.prod(scan.shape), scan.time))
+
+    # the full grid (interpolated within the unrefined cells) for visualize_*points.py
+    scan.export('result_adaptive.pickle')
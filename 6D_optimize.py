@@ -0,0 +1,61 @@
+from multiprocessing import Pool
+from kinetics_prop import KineticsProp
+from yield_optimizer import YieldOptimizer
+from scan_settings import KINETIC_PARAMS, SCAN_RANGES
+import spectra
+import timeit
+
+if __name__ == '__main__':
+
+    start = timeit.default_timer()
+
+    import pickle
+
+    ##############################################################################
+    #                                                                            #
+    #                               DEFINING BOUNDS                              #
+    #                                                                            #
+    ##############################################################################
+
+    axes_names = list(SCAN_RANGES)
+
+    bounds = list(SCAN_RANGES.values())
+
+    ##############################################################################
+    #                                                                            #
+    #                           DEFINING KINETIC PARAMETERS                      #
+    #                                                                            #
+    ##############################################################################
+
+    kinetic_params = dict(KINETIC_PARAMS)
+
+    optimizer = YieldOptimizer(
+        KineticsProp(**kinetic_params).batch,
+        bounds,
+        pool=Pool(4, initializer=spectra.install, initargs=(spectra.load(),)),
+        n_workers=4,
+        n_samples=64,
+        n_starts=4,
+        seed=0,
+    )
+
+    best_point, best_value = optimizer()
+    time = timeit.default_timer() - start
+
+    print('Maximal population %g after %d evaluations at' % (best_value, len(optimizer.values)))
+    for name, value in zip(axes_names, best_point):
+        print('    %s = %g' % (name, value))
+
+    with open('optimize.pickle', 'wb') as file_out:
+        pickle.dump(
+            {
+                'kinetic_params': kinetic_params,
+                'axes_names': axes_names,
+                'bounds': bounds,
+                'best_point': best_point,
+                'best_value': best_value,
+                'log': optimizer.log(),
+                'time': time
+            },
+            file_out
+        )
@@ -1,29 +1,21 @@
 from multiprocessing import Pool
 import numpy as np
 from kinetics_prop import KineticsProp
-import timeit
+from scan_runner import ScanRunner
+from result_cache import ResultCache
+from emulator import Emulator
+from scan_settings import KINETIC_PARAMS, grid
+import spectra
 
 if __name__ == '__main__':
 
-    start = timeit.default_timer()
-
-    from itertools import product
-    import pickle
-
     ##############################################################################
     #                                                                            #
     #                               DEFINING GRIDS                               #
     #                                                                            #
     ##############################################################################
 
-    N1 = N2 = N3 = N4 = N5 = N6 = 3
-
-    pump_energy = np.linspace(0.1, 0.4, N1)
-    dump_energy = np.linspace(1.0, 3.0, N2)
-    pump_width = np.linspace(.050, .150, N3)
-    dump_width = np.linspace(.100, .200, N4)
-    t0_pump = np.linspace(0.25, 0.75, N5)
-    t0_dump = np.linspace(0.30, 0.80, N6)
+    params = grid(3)
 
     ##############################################################################
     #                                                                            #
@@ -31,58 +23,38 @@ if __name__ == '__main__':
     #                                                                            #
     ##############################################################################
 
-    kinetic_params = dict(
-        # Pulses characterization
-        pump_central=625.,
-        pump_bw=40.,
-
-        dump_central=835.,
-        dump_bw=10.,
-
-        beam_diameter=200.,
-
-        T_max=100.0,
-        T_steps=1000,
-
-        A_41=1 / .150,
-        A_23=1 / .150,
-        A_35=1 / 68.5,
-        A_34=2.5 / 68.5,
-        A_56=1 / 0.1,
-
-        A_96=1 / .050,
-        A_78=1 / .050,
-        A_810=1 / 2.5,
-        A_89=2.0,
-        A_101=1 / 0.1,
-
-        Iterations=51,
+    kinetic_params = dict(KINETIC_PARAMS)
+
+    # the results are checkpointed into the directory result_scan,
+    # rerunning the script after an interruption finishes the remaining points only
+    runner = ScanRunner(
+        'result_scan',
+        params=params,
+        kinetic_params=kinetic_params,
+        # each worker propagates about batch_size points at once
+        chunk_size=kinetic_params['batch_size'],
+        # the points of a work unit differing only by the pulse energies share the time profiles
+        sweep_axes=(0, 1),
+        # the points computed by any earlier scan with the same kinetic_params are not recomputed
+        cache=ResultCache('result_cache.sqlite', kinetic_params, settings={'engine': 'KineticsProp.sweep'}),
     )
 
-    result = Pool(4).map(
-        KineticsProp(**kinetic_params),
-        product(pump_energy, dump_energy, pump_width, dump_width, t0_pump, t0_dump)
+    # to spread the scan over many machines, replace the pool by work_queue.FileQueue('<shared directory>')
+    # and start `python work_queue.py <shared directory>` on each machine
+    result = runner.run(
+        KineticsProp(**kinetic_params).sweep,
+        pool=Pool(4, initializer=spectra.install, initargs=(spectra.load(),)),
+        vectorized=True
     )
 
-    print result
+    print(result)
+
+    runner.export('result.pickle')
 
-    result = np.array(result).reshape(N1, N2, N3, N4, N5, N6)
-    time = timeit.default_timer() - start
+    # the same results in the chunked format, opened and sliced lazily by scan_store.ScanStore
+    runner.save('result_store', dtype=np.float32, compress=True)
 
-    with open('result.pickle', 'wb') as file_out:
-        pickle.dump(
-            {
-                'kinetic_params' : kinetic_params,
-                'params': {
-                    'pump_energy': pump_energy,
-                    'dump_energy': dump_energy,
-                    'pump_width': pump_width,
-                    'dump_width': dump_width,
-                    't0_pump': t0_pump,
-                    't0_dump': t0_dump
-                },
-                'result': result,
-                'time': time
-            },
-            file_out
-        )
+    # interpolant of the scan answering off-grid queries without propagating the kinetics
+    emulator = Emulator(runner.params, result)
+    print('Emulator error estimate: %s' % emulator.cross_validate())
+    emulator.save('result_emulator.pickle')
@@ -0,0 +1,55 @@
+from multiprocessing import Pool
+from kinetics_prop import KineticsProp
+from scan_runner import ScanRunner
+from scipy import stats
+from uncertainty import RateUncertainty
+from scan_settings import KINETIC_PARAMS, grid
+import spectra
+
+if __name__ == '__main__':
+
+    ##############################################################################
+    #                                                                            #
+    #                               DEFINING GRIDS                               #
+    #                                                                            #
+    ##############################################################################
+
+    params = grid(3)
+
+    ##############################################################################
+    #                                                                            #
+    #                           DEFINING KINETIC PARAMETERS                      #
+    #                                                                            #
+    ##############################################################################
+
+    kinetic_params = dict(KINETIC_PARAMS)
+
+    # log-normal uncertainties of the lifetimes (relative standard deviation of about 20%)
+    distributions = dict(
+        (name, stats.lognorm(0.2, scale=kinetic_params[name]))
+        for name in ['A_41', 'A_23', 'A_35', 'A_34', 'A_56', 'A_96', 'A_78', 'A_810', 'A_89', 'A_101']
+    )
+
+    uncertainty = RateUncertainty(KineticsProp(**kinetic_params), distributions, n_samples=1000, seed=0)
+
+    # the mean, the standard deviation and the quantiles of the population at each grid point
+    runner = ScanRunner(
+        'result_uncertainty',
+        params=params,
+        # the description of the samples makes sure a resumed scan uses the same ones
+        kinetic_params=dict(kinetic_params, uncertainty=uncertainty.description()),
+        outputs=uncertainty.outputs,
+        # a work unit per point, all the samples of a point are propagated together
+        chunk_size=1,
+    )
+
+    result = runner.run(
+        uncertainty,
+        pool=Pool(4, initializer=spectra.install, initargs=(spectra.load(),)),
+        vectorized=True
+    )
+
+    runner.export('result_uncertainty.pickle')
+
+    # a store of the map of each output (result_uncertainty_store/mean, .../std, ...) for the visualization
+    runner.save('result_uncertainty_store')
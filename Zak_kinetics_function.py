@@ -1,30 +1,72 @@
 from scipy.integrate import odeint, simps, ode
 import numpy as np
+import timeit
 from Pr_ODE_solver import Pr_ODE, Pr_ODE_jacobian
 from Pfr_ODE_solver import Pfr_ODE, Pfr_ODE_jacobian
+from steady_state import steady_state
+import spectra
+import instrumentation
 
+# Number of pulses (the initial state counts as the first iteration)
+ITERATIONS = 51
 
-def kinetic_function(parameters):
+
+def pulse_propagator(ode, jacobian, t_axis, args, stats=None):
+    """
+    Return the 5x5 transfer matrix of the linear rate equations ode over t_axis
+    (the solver counters are added to stats if given)
+    """
+    if stats is None:
+        return np.transpose([
+            odeint(ode, e, t_axis, args=args, Dfun=jacobian)[-1] for e in np.eye(5)
+        ])
+
+    columns = []
+
+    for e in np.eye(5):
+        p, info = odeint(ode, e, t_axis, args=args, Dfun=jacobian, full_output=True)
+        instrumentation.add_odeint(stats, info)
+        columns.append(p[-1])
+
+    return np.transpose(columns)
+
+
+def kinetic_function(parameters, iterations=ITERATIONS, tol=None, history=False, stats=None):
+    """
+    Return the total Pr population after repeated pump-dump pulses.
+
+    The populations of the Pr and Pfr forms are mapped from pulse to pulse by the transfer matrix
+    of a single pulse (including the re-injection of the populations of the 5th states).
+
+        parameters -- (pump_energy, dump_energy, pump_width, dump_width, t0_pump, t0_dump)
+        iterations -- number of iterations (None means the limit of infinitely many pulses)
+        tol -- stop once the populations change by less than tol over one pulse
+        history -- also return the Pr and Pfr populations after each pulse (arrays of shape (iterations, 5))
+        stats -- dict to be filled with the solver counters and the stage timings (see instrumentation)
+    """
+    start = timeit.default_timer()
 
     # ===========================================================================#
     # ------------------- READ SPECTRAL PARAMETERS FROM FILE --------------------#
     # ===========================================================================#
 
-    data = np.loadtxt("Cph8_RefSpectra.csv", delimiter=',')
+    data = spectra.load().data
 
-    lamb = np.array(data[:, 0])
-    Pr_abs = np.array(data[:, 1])
-    Pr_ems = np.array(data[:, 2])
-    Pfr_abs = np.array(data[:, 3])
-    Pfr_ems = np.array(data[:, 4])
+    # NB: this engine keeps its historical assignment of the columns
+    # (columns 2 and 3 are swapped with respect to spectra.load() and KineticsProp)
+    lamb = data[:, 0]
+    Pr_abs = data[:, 1]
+    Pr_ems = data[:, 2]
+    Pfr_abs = data[:, 3]
+    Pfr_ems = data[:, 4]
 
     # ===========================================================================#
     # -------GET ABSORPTION EMISSION DATA OF PR AND PFR STATES BY SCALING--------#
     # ===========================================================================#
-    Pr_abs *= 60000 / Pr_abs.max()
-    Pfr_abs *= 50000 / Pfr_abs.max()
-    Pr_ems *= 60000 / Pr_ems.max()
-    Pfr_ems *= 50000 / Pfr_ems.max()
+    Pr_abs = Pr_abs * (60000 / Pr_abs.max())
+    Pfr_abs = Pfr_abs * (50000 / Pfr_abs.max())
+    Pr_ems = Pr_ems * (60000 / Pr_ems.max())
+    Pfr_ems = Pfr_ems * (50000 / Pfr_ems.max())
 
     # ===========================================================================#
     # -------------- PUMP DUMP PULSE TRANSITION RATE CALCULATION  ---------------#
@@ -69,38 +111,58 @@ def kinetic_function(parameters):
     K_Pfr_34_pump = simps(1.92e3 * pump_spectra * lamb * Pfr_ems / beam_area, lamb)
     K_Pfr_34_dump = simps(1.92e3 * dump_spectra * lamb * Pfr_ems / beam_area, lamb)
 
-    A_41_Pr = 1 / .150
-    A_23_Pr = 1 / .150
-    A_35_Pr = 1 / 68.5
-    A_34_Pr = A_35_Pr * 2.5
-
-    A_41_Pfr = 1 / .050
-    A_23_Pfr = 1 / .050
-    A_35_Pfr = 1 / 2.5
-    A_34_Pfr = A_35_Pfr * 5.0
-
-    Iterations = 51
-
-    PR = np.zeros([Iterations, 5])
-    PFR = np.zeros_like(PR)
-
-    PR[0][0] = PFR[0][0] = 0.5
-
-    for i in range(Iterations-1):
-        PR[i][0] += PFR[i][4]
-        PFR[i][0] += PR[i][4]
-        PR[i][4] = 0.0
-        PFR[i][4] = 0.0
-        sol_Pr = odeint(Pr_ODE, PR[i], t_axis,
-                        args=(K_Pr_12_pump, K_Pr_12_dump, K_Pr_34_pump, K_Pr_34_dump,
-                              t0_pump, pump_width, t0_dump, dump_width),
-                        Dfun=Pr_ODE_jacobian)
-        sol_Pfr = odeint(Pfr_ODE, PFR[i], t_axis,
-                         args=(K_Pfr_12_pump, K_Pfr_12_dump, K_Pfr_34_pump, K_Pfr_34_dump,
-                               t0_pump, pump_width, t0_dump, dump_width),
-                         Dfun=Pfr_ODE_jacobian)
-
-        PR[i+1][:] = sol_Pr[-1]
-        PFR[i + 1][:] = sol_Pfr[-1]
-
-    return PR[-1].sum()
+    # the rate constants of the Pr and Pfr forms are PR_RATES and PFR_RATES of the ODE solvers
+
+    instrumentation.add(stats, 'time_spectral', timeit.default_timer() - start)
+
+    # ===========================================================================#
+    # ------------------------ TRANSFER MATRIX OF ONE PULSE ---------------------#
+    # ===========================================================================#
+
+    with instrumentation.stage(stats, 'time_propagation'):
+        P_Pr = pulse_propagator(
+            Pr_ODE, Pr_ODE_jacobian, t_axis,
+            (K_Pr_12_pump, K_Pr_12_dump, K_Pr_34_pump, K_Pr_34_dump, t0_pump, pump_width, t0_dump, dump_width),
+            stats
+        )
+        P_Pfr = pulse_propagator(
+            Pfr_ODE, Pfr_ODE_jacobian, t_axis,
+            (K_Pfr_12_pump, K_Pfr_12_dump, K_Pfr_34_pump, K_Pfr_34_dump, t0_pump, pump_width, t0_dump, dump_width),
+            stats
+        )
+
+    # the populations of the 5th states are re-injected into the ground state of the other form
+    # before the pulse: PR[0] += PFR[4], PFR[0] += PR[4], PR[4] = PFR[4] = 0
+    T = np.zeros([10, 10])
+    T[:5, :5] = P_Pr
+    T[5:, 5:] = P_Pfr
+    T[:, 9] = T[:, 0]
+    T[:, 4] = T[:, 5]
+
+    # the state [PR, PFR] before the first pulse
+    p0 = np.zeros(10)
+    p0[0] = p0[5] = 0.5
+
+    with instrumentation.stage(stats, 'time_steady_state'):
+        if iterations is None:
+            if history:
+                raise ValueError("The history is not available for the limit of infinitely many pulses")
+            return steady_state(T)[:5].sum()
+
+        if not history and tol is None:
+            return np.linalg.matrix_power(T, iterations - 1).dot(p0)[:5].sum()
+
+        populations = [p0]
+
+        for i in range(iterations - 1):
+            populations.append(T.dot(populations[-1]))
+
+            if tol is not None and np.abs(populations[-1] - populations[-2]).max() < tol:
+                break
+
+        populations = np.array(populations)
+
+        if history:
+            return populations[-1, :5].sum(), populations[:, :5], populations[:, 5:]
+
+        return populations[-1, :5].sum()
@@ -0,0 +1,255 @@
+"""
+Adaptive multi-resolution scan over a regular parameter grid.
+
+The scan starts from a coarse subgrid of the full (fine) grid. The grid is partitioned into cells
+whose corners are evaluated; the cells where the (physically valid) value or its variation
+across the cell is high are halved along each axis until they reach the spacing of the full grid.
+The evaluated points are kept as a sparse, sorted list of the flat indices of the full grid,
+and the full grid can be reconstructed by multilinear interpolation inside the unrefined cells
+for the plotting scripts.
+"""
+import pickle
+import timeit
+from collections import OrderedDict
+from functools import partial
+from itertools import product
+import numpy as np
+from scan_runner import evaluate_unit
+
+
+class AdaptiveScan(object):
+    """
+    Scan refining only the promising cells of a regular grid
+    """
+
+    # Number of points along each axis of the initial coarse grid
+    coarse_points = 3
+
+    # Fraction of the initial cells with the highest values (and, separately, with the highest variations)
+    # defining the thresholds for the refinement
+    refine_fraction = 0.1
+
+    # Number of grid points evaluated in a work unit
+    chunk_size = 1000
+
+    def __init__(self, params, kinetic_params=None, **kwargs):
+        """
+               params -- ordered dict of the axes of the full grid {name: values}
+               kinetic_params -- parameters of the kinetics stored alongside the results
+
+         Optional:
+
+               coarse_points -- number of points along each axis of the initial grid
+               refine_fraction -- fraction of the initial cells setting the refinement thresholds
+               chunk_size -- number of grid points in a work unit
+        """
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+        self.params = OrderedDict((name, np.asarray(values)) for name, values in params.items())
+        self.kinetic_params = kinetic_params
+        self.shape = tuple(len(values) for values in self.params.values())
+
+        # sparse storage of the evaluated grid points
+        self.indices = np.zeros(0, dtype=int)
+        self.values = np.zeros(0)
+
+        self.time = 0.
+
+    def __len__(self):
+        return len(self.indices)
+
+    def lookup(self, indices):
+        """
+        Return the values at the grid points with the given flat indices (NaN for the points not evaluated)
+        """
+        indices = np.asarray(indices)
+        position = np.clip(np.searchsorted(self.indices, indices), 0, max(len(self.indices) - 1, 0))
+
+        values = np.full(indices.shape, np.nan)
+
+        if len(self.indices):
+            found = self.indices[position] == indices
+            values[found] = self.values[position[found]]
+
+        return values
+
+    def __getitem__(self, multi_index):
+        """
+        Return the value at the grid point given by its index along each axis
+        """
+        value = self.lookup(np.ravel_multi_index(multi_index, self.shape))
+
+        if np.isnan(value):
+            raise KeyError("Grid point %s has not been evaluated" % (multi_index,))
+
+        return float(value)
+
+    def value_at(self, point):
+        """
+        Return the value at the grid point given by its parameters
+        """
+        multi_index = []
+
+        for values, x in zip(self.params.values(), point):
+            index = int(np.argmin(np.abs(values - x)))
+
+            if not np.isclose(values[index], x):
+                raise KeyError("%g is not on the grid" % x)
+
+            multi_index.append(index)
+
+        return self[tuple(multi_index)]
+
+    def insert(self, indices, values):
+        """
+        Add the evaluated points to the storage
+        """
+        indices = np.concatenate([self.indices, indices])
+        values = np.concatenate([self.values, values])
+
+        self.indices, unique = np.unique(indices, return_index=True)
+        self.values = values[unique]
+
+    def evaluate(self, func, indices, pool=None):
+        """
+        Evaluate the vectorized func at the grid points with the given flat indices not evaluated yet
+        """
+        indices = np.setdiff1d(indices, self.indices)
+
+        if not indices.size:
+            return
+
+        start = timeit.default_timer()
+
+        evaluate = partial(evaluate_unit, func, list(self.params.values()), True)
+        units = [indices[n:n + self.chunk_size] for n in range(0, indices.size, self.chunk_size)]
+
+        for unit in (pool.imap_unordered(evaluate, units) if pool is not None else map(evaluate, units)):
+            self.insert(*unit[:2])
+
+        self.time += timeit.default_timer() - start
+
+    def corners(self, lo, hi):
+        """
+        Return the flat indices of the corners of the cells [lo, hi] (arrays of shape (number of cells, ndim))
+        """
+        bits = np.array(list(product([0, 1], repeat=len(self.shape))))
+        corners = lo[:, np.newaxis, :] + bits[np.newaxis, :, :] * (hi - lo)[:, np.newaxis, :]
+
+        return np.ravel_multi_index(tuple(np.moveaxis(corners, -1, 0)), self.shape)
+
+    def scores(self, lo, hi):
+        """
+        Return the maximal value and the variation (max - min) of the valid values at the corners of each cell
+        """
+        values = self.lookup(self.corners(lo, hi))
+        values[(values > 1) | (values < 0)] = np.nan
+
+        with np.errstate(invalid='ignore'):
+            highest = np.nanmax(np.where(np.isnan(values), -np.inf, values), axis=1)
+            lowest = np.nanmin(np.where(np.isnan(values), np.inf, values), axis=1)
+
+        return highest, np.where(np.isfinite(highest - lowest), highest - lowest, 0.)
+
+    @staticmethod
+    def subdivide(lo, hi):
+        """
+        Return the cells obtained by halving the cells [lo, hi] along every axis longer than one grid step
+        """
+        mid = (lo + hi) // 2
+        halves = [(lo, np.where(hi - lo > 1, mid, hi)), (np.where(hi - lo > 1, mid, lo), hi)]
+
+        children_lo, children_hi = [], []
+
+        for choice in product([0, 1], repeat=lo.shape[1]):
+            children_lo.append(np.column_stack([halves[c][0][:, axis] for axis, c in enumerate(choice)]))
+            children_hi.append(np.column_stack([halves[c][1][:, axis] for axis, c in enumerate(choice)]))
+
+        lo, hi = np.concatenate(children_lo), np.concatenate(children_hi)
+
+        # drop the degenerate duplicates along the axes that were not halved
+        cells = np.unique(np.hstack([lo, hi]), axis=0)
+        return cells[:, :lo.shape[1]], cells[:, lo.shape[1]:]
+
+    def run(self, func, pool=None):
+        """
+        Run the adaptive scan of the vectorized func (e.g., KineticsProp.sweep)
+        """
+        # ===========================================================================#
+        # -------------------------------- COARSE GRID ------------------------------#
+        # ===========================================================================#
+        coarse = [
+            np.unique(np.linspace(0, n - 1, min(self.coarse_points, n)).round().astype(int)) for n in self.shape
+        ]
+
+        lo = np.array(list(product(*[c[:-1] if len(c) > 1 else c for c in coarse])))
+        hi = np.array(list(product(*[c[1:] if len(c) > 1 else c for c in coarse])))
+
+        self.evaluate(func, self.corners(lo, hi).ravel(), pool)
+
+        highest, variation = self.scores(lo, hi)
+
+        value_threshold = np.percentile(highest, 100. * (1. - self.refine_fraction))
+        variation_threshold = np.percentile(variation, 100. * (1. - self.refine_fraction))
+
+        # ===========================================================================#
+        # -------------------------------- REFINEMENT -------------------------------#
+        # ===========================================================================#
+        self.leaves = []
+
+        while len(lo):
+            highest, variation = self.scores(lo, hi)
+
+            refine = ((highest >= value_threshold) | (variation >= variation_threshold)) \
+                & ((hi - lo).max(axis=1) > 1)
+
+            self.leaves.append((lo[~refine], hi[~refine]))
+
+            if not refine.any():
+                break
+
+            lo, hi = self.subdivide(lo[refine], hi[refine])
+
+            self.evaluate(func, self.corners(lo, hi).ravel(), pool)
+
+        self.leaves = tuple(np.concatenate(cells) for cells in zip(*self.leaves))
+
+        return self
+
+    def to_grid(self, interpolate=True):
+        """
+        Return the values on the full grid, the points not evaluated are either interpolated
+        (multilinearly within the unrefined cells) or NaN
+        """
+        grid = np.full(self.shape, np.nan)
+
+        if interpolate:
+            for lo, hi in zip(*self.leaves):
+                values = self.lookup(self.corners(lo[np.newaxis], hi[np.newaxis])).reshape((2,) * len(self.shape))
+
+                for a, b in zip(lo, hi):
+                    weight = (np.arange(a, b + 1) - a) / float(max(b - a, 1))
+                    values = np.multiply.outer(values[0], 1. - weight) + np.multiply.outer(values[1], weight)
+
+                grid[tuple(slice(a, b + 1) for a, b in zip(lo, hi))] = values
+
+        grid.reshape(-1)[self.indices] = self.values
+
+        return grid
+
+    def export(self, filename, interpolate=True):
+        """
+        Save the scan in the format of result.pickle (with the full grid reconstructed by to_grid)
+        """
+        with open(filename, 'wb') as file_out:
+            pickle.dump(
+                {
+                    'kinetic_params': self.kinetic_params,
+                    'params': dict(self.params),
+                    'result': self.to_grid(interpolate),
+                    'evaluated': self.indices,
+                    'time': self.time
+                },
+                file_out
+            )
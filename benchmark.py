@@ -0,0 +1,306 @@
+"""
+Benchmarks of the kinetics engines and of the scan pipeline.
+
+Every case times a fixed reference input (the example of kinetics_prop.py) and reports the time in seconds
+per call (or per grid point for the batches and scans); the cases computing a population also check it
+against the reference value (REFERENCE_VALUES). The times are compared with the stored baseline relative
+to the time of a fixed calibration workload measured around each case (so that the load and the clock
+frequency of the machine cancel out), and the script fails when a case is slower than the baseline
+by more than the tolerance or returns a wrong population.
+
+        python benchmark.py                     -- run all the cases and compare with benchmark_baseline.json
+        python benchmark.py scan_3_workers_4    -- run the selected cases only
+        python benchmark.py --save-baseline     -- store the times of this machine as the baseline
+
+The baseline (the times only) is specific to the machine it was measured on and is not kept
+under version control, the first run on a machine stores it.
+"""
+import os
+import sys
+import json
+import shutil
+import platform
+import tempfile
+import argparse
+import timeit
+from collections import OrderedDict
+from multiprocessing import Pool
+import numpy as np
+from kinetics_prop import KineticsProp
+from Zak_kinetics_function import kinetic_function
+from scan_runner import ScanRunner
+from steady_state import steady_state
+from scan_settings import grid
+import spectra
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Allowed relative slowdown with respect to the baseline
+TOLERANCE = 0.25
+
+# Allowed deviation of the populations from the reference values
+VALUE_TOL = 1e-6
+
+# Populations returned by the cases (independent of the machine)
+REFERENCE_VALUES = {
+    'kinetics_prop_call': 0.7894470579,
+    'kinetics_prop_call_window': 0.7894470722,
+    'kinetics_prop_call_final': 0.7894470709,
+    'kinetics_prop_batch': 0.7894471519,
+    'kinetic_function': 0.7744239301,
+}
+
+# The example of kinetics_prop.py
+EXAMPLE_PARAMS = dict(
+    pump_central=625.,
+    pump_bw=40.,
+
+    dump_central=835.,
+    dump_bw=10.,
+
+    beam_diameter=200.,
+
+    T_max=100.0,
+    T_steps=1000,
+
+    A_41=1 / .150,
+    A_23=1 / .150,
+    A_35=1 / 68.5,
+    A_34=2.5 / 68.5,
+    A_56=1 / 0.01,
+
+    A_96=1 / .050,
+    A_78=1 / .050,
+    A_810=1 / 2.5,
+    A_89=2.0,
+    A_101=1 / 0.01,
+
+    Iterations=51,
+)
+
+EXAMPLE_POINT = (0.25, 2.0, .100, .150, 0.5, 0.5251)
+
+# Settings of the scans of 6D_scan.py
+SCAN_PARAMS = dict(EXAMPLE_PARAMS, pulse_tol=1e-10, propagator='matrix', batch_size=1000)
+
+
+def best_time(func, repeat=3, number=1):
+    """
+    Return the shortest time of a call of func out of repeat runs of number calls
+    """
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def calibration():
+    """
+    Return the time of a fixed workload of small numpy operations driven by Python
+    (as the r.h.s. calls of the ODE solvers), the unit of the times compared with the baseline
+    """
+    A = np.random.RandomState(0).uniform(size=(10, 10))
+
+    def work():
+        x = np.ones(10)
+        for _ in range(10000):
+            x = A.dot(x)
+            x /= x.sum()
+
+    return best_time(work, repeat=5)
+
+
+####################################################################################################
+#
+#   Cases (each returns the time in seconds per call or per point and the population computed, if any)
+#
+####################################################################################################
+
+def kinetics_prop_call():
+    kinetics = KineticsProp(**EXAMPLE_PARAMS)
+    return best_time(lambda: kinetics(EXAMPLE_POINT)), kinetics(EXAMPLE_POINT)
+
+
+def kinetics_prop_call_window():
+    kinetics = KineticsProp(**dict(EXAMPLE_PARAMS, pulse_tol=1e-10, propagator='matrix'))
+    return best_time(lambda: kinetics(EXAMPLE_POINT), number=5), kinetics(EXAMPLE_POINT)
+
+
+def kinetics_prop_call_final():
+    kinetics = KineticsProp(**dict(EXAMPLE_PARAMS, propagator='final'))
+    return best_time(lambda: kinetics(EXAMPLE_POINT), number=5), kinetics(EXAMPLE_POINT)
+
+
+def kinetics_prop_batch():
+    kinetics = KineticsProp(**SCAN_PARAMS)
+    points = np.tile(EXAMPLE_POINT, (64, 1))
+    return best_time(lambda: kinetics.batch(points)) / len(points), kinetics.batch(points)[0]
+
+
+def kinetic_function_call():
+    return best_time(lambda: kinetic_function(EXAMPLE_POINT)), kinetic_function(EXAMPLE_POINT)
+
+
+def transfer_matrix():
+    kinetics = KineticsProp(**EXAMPLE_PARAMS)
+    kinetics.set_pulses(EXAMPLE_POINT)
+    return best_time(lambda: kinetics.transfer_matrix(kinetics.t_axis)), None
+
+
+def steady_state_solve():
+    kinetics = KineticsProp(**EXAMPLE_PARAMS)
+    kinetics.set_pulses(EXAMPLE_POINT)
+    M = kinetics.transfer_matrix(kinetics.t_axis)
+    return best_time(lambda: steady_state(M), number=1000), None
+
+
+def spectral_overlaps():
+    kinetics = KineticsProp(**EXAMPLE_PARAMS)
+
+    def setup():
+        kinetics._overlaps.clear()
+        kinetics.spectral_overlaps(kinetics.pump_central, kinetics.pump_bw)
+        kinetics.spectral_overlaps(kinetics.dump_central, kinetics.dump_bw)
+
+    return best_time(setup, number=100), None
+
+
+def scan(n_points, n_workers, repeat=3):
+    """
+    Return the case of the scan of the grid of n_points along each axis by n_workers processes
+    (the shortest time out of repeat scans)
+    """
+    def case():
+        params = grid(n_points)
+        pool = Pool(n_workers, initializer=spectra.install, initargs=(spectra.load(),))
+        times = []
+
+        try:
+            # the pool is started before the timing
+            pool.map(abs, range(n_workers))
+
+            for _ in range(repeat):
+                path = tempfile.mkdtemp()
+
+                try:
+                    runner = ScanRunner(
+                        path, params, SCAN_PARAMS, chunk_size=SCAN_PARAMS['batch_size'] // n_workers,
+                        sweep_axes=(0, 1), report_interval=None
+                    )
+
+                    start = timeit.default_timer()
+                    runner.run(KineticsProp(**SCAN_PARAMS).sweep, pool=pool, vectorized=True)
+                    times.append((timeit.default_timer() - start) / runner.done.size)
+                finally:
+                    shutil.rmtree(path)
+
+            return min(times), None
+        finally:
+            pool.terminate()
+
+    return case
+
+
+CASES = OrderedDict([
+    ('kinetics_prop_call', kinetics_prop_call),
+    ('kinetics_prop_call_window', kinetics_prop_call_window),
+    ('kinetics_prop_call_final', kinetics_prop_call_final),
+    ('kinetics_prop_batch', kinetics_prop_batch),
+    ('kinetic_function', kinetic_function_call),
+    ('transfer_matrix', transfer_matrix),
+    ('steady_state', steady_state_solve),
+    ('spectral_overlaps', spectral_overlaps),
+])
+
+for _n_points in (2, 3):
+    for _n_workers in (1, 2, 4):
+        CASES['scan_%d_workers_%d' % (_n_points, _n_workers)] = scan(_n_points, _n_workers)
+
+
+def run(names, baseline=None, tolerance=TOLERANCE, out=sys.stdout):
+    """
+    Run the cases and return their times {name: {'seconds': ..., 'relative': ...}}
+    (relative -- the time in the units of the calibration workload) and the list of the failures
+    """
+    results = OrderedDict()
+    failures = []
+
+    for name in names:
+        # the calibration before and after the case (a transient load slows down either of them)
+        unit = calibration()
+        seconds, value = CASES[name]()
+        unit = min(unit, calibration())
+        results[name] = {'seconds': seconds, 'relative': seconds / unit}
+
+        line = '%-28s %12.6g s' % (name, seconds)
+        if name.startswith('scan') or name.endswith('batch'):
+            line += ' (%.1f points/s)' % (1. / seconds)
+
+        reference = (baseline or {}).get(name)
+
+        if reference is not None:
+            if 'relative' in reference:
+                ratio = seconds / unit / reference['relative']
+            else:
+                ratio = seconds / reference['seconds']
+            line += '   x%.2f of the baseline' % ratio
+
+            if ratio > 1. + tolerance:
+                failures.append('%s is %.0f%% slower than the baseline' % (name, 100. * (ratio - 1.)))
+                line += '   SLOWER'
+
+        if name in REFERENCE_VALUES and abs(value - REFERENCE_VALUES[name]) > VALUE_TOL:
+            failures.append('%s returned %.10g instead of %.10g' % (name, value, REFERENCE_VALUES[name]))
+            line += '   WRONG VALUE'
+
+        out.write(line + '\n')
+        out.flush()
+
+    return results, failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('cases', nargs='*', help='cases to run (all by default): %s' % ', '.join(CASES))
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed relative slowdown')
+    parser.add_argument('--save-baseline', action='store_true', help='store the times as the baseline')
+    args = parser.parse_args()
+
+    for name in args.cases:
+        if name not in CASES:
+            parser.error("unknown case '%s'" % name)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as file_in:
+            stored = json.load(file_in)
+        baseline = stored['cases']
+
+        if stored.get('machine') != platform.platform():
+            sys.stderr.write('The baseline was measured on %s, store a new one on this machine\n'
+                             % stored.get('machine'))
+
+    elif not os.path.exists(args.baseline):
+        # the first run on this machine
+        args.save_baseline = True
+
+    results, failures = run(args.cases or list(CASES), baseline, args.tolerance)
+
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file_in:
+                stored = json.load(file_in, object_pairs_hook=OrderedDict)['cases']
+        else:
+            stored = OrderedDict()
+
+        stored.update(results)
+
+        with open(args.baseline, 'w') as file_out:
+            json.dump(
+                {'machine': platform.platform(), 'processor': platform.processor(), 'cases': stored},
+                file_out, indent=4
+            )
+            file_out.write('\n')
+
+    for failure in failures:
+        sys.stderr.write('REGRESSION: %s\n' % failure)
+
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,211 @@
+"""
+Emulator of the kinetics interpolating a completed scan.
+
+The values of a scan over a regular grid are interpolated by a tensor-product interpolant
+(multilinear or a spline of RegularGridInterpolator), so the population at any point inside the grid
+is returned without propagating the kinetics. The invalid values of the scan (NaN or out of [0, 1])
+are replaced by the nearest valid ones before the interpolant is built.
+
+The interpolation error is estimated from held-out grid points: the emulator of the subgrid of every other point
+along each axis is evaluated at the remaining points (a conservative estimate for the full grid),
+or from any points evaluated by KineticsProp (validate()).
+"""
+import pickle
+from collections import OrderedDict
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+from scipy.ndimage import distance_transform_edt
+from scipy.optimize import minimize
+from scan_store import AXES_NAMES, VALID_RANGE
+
+
+class Emulator(object):
+    """
+    Interpolant of the scan results callable with an (N, number of axes) array of points
+    """
+
+    # Interpolation method of RegularGridInterpolator: 'linear' (microseconds per point) or, for small grids only,
+    # a spline such as 'cubic' (solved for globally, which does not fit into memory for 6D grids of 9 points per axis)
+    method = 'linear'
+
+    def __init__(self, params, result, **kwargs):
+        """
+               params -- ordered dict of the scan axes {name: values}
+               result -- array of the scan results
+
+         Optional:
+
+               method -- interpolation method of RegularGridInterpolator
+        """
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+        self.params = OrderedDict((name, np.asarray(values, dtype=float)) for name, values in params.items())
+        self.values = self.fill_invalid(np.asarray(result, dtype=float))
+
+        self.lower = np.array([values.min() for values in self.params.values()])
+        self.upper = np.array([values.max() for values in self.params.values()])
+
+        self.interpolant = RegularGridInterpolator(
+            list(self.params.values()), self.values, method=self.method, bounds_error=False, fill_value=np.nan
+        )
+
+        # error estimate (see cross_validate and validate)
+        self.error = None
+
+    @staticmethod
+    def fill_invalid(result):
+        """
+        Return a copy of the result with the invalid values replaced by the nearest valid ones
+        """
+        invalid = ~((result >= VALID_RANGE[0]) & (result <= VALID_RANGE[1]))
+
+        if not invalid.any():
+            return result.copy()
+
+        if invalid.all():
+            raise ValueError("The scan has no valid values")
+
+        nearest = distance_transform_edt(invalid, return_distances=False, return_indices=True)
+        return result[tuple(nearest)]
+
+    @classmethod
+    def from_pickle(cls, filename, **kwargs):
+        """
+        Return the emulator of the scan saved in the format of result.pickle
+        """
+        with open(filename, 'rb') as file_in:
+            data = pickle.load(file_in)
+
+        params = data['params']
+
+        if not isinstance(params, OrderedDict):
+            params = OrderedDict((name, params[name]) for name in AXES_NAMES)
+
+        return cls(params, data['result'], **kwargs)
+
+    @classmethod
+    def from_store(cls, store, **kwargs):
+        """
+        Return the emulator of the scan saved in a scan_store.ScanStore
+        """
+        return cls(store.params, store[...], **kwargs)
+
+    def __call__(self, points):
+        """
+        Return the interpolated values at the points (NaN outside of the grid)
+        """
+        return self.interpolant(np.atleast_2d(points))
+
+    def validate(self, points, values):
+        """
+        Return the errors of the emulator at the points where the values are known (e.g., computed by KineticsProp)
+        """
+        errors = np.abs(self(points) - np.asarray(values, dtype=float))
+
+        return {
+            'max': float(np.nanmax(errors)),
+            'rms': float(np.sqrt(np.nanmean(errors ** 2))),
+            'points': int(np.count_nonzero(~np.isnan(errors))),
+        }
+
+    def cross_validate(self):
+        """
+        Estimate the error by the emulator of the subgrid of every other point (along the axes of at least 3 points)
+        evaluated at the held-out grid points
+        """
+        kept = [
+            np.arange(len(values)) % 2 == 0 if len(values) >= 3 else np.ones(len(values), dtype=bool)
+            for values in self.params.values()
+        ]
+
+        # the last point of each axis is kept so that the subgrid spans the whole grid
+        for k in kept:
+            k[-1] = True
+
+        subgrid = Emulator(
+            OrderedDict((name, values[k]) for (name, values), k in zip(self.params.items(), kept)),
+            self.values[np.ix_(*kept)],
+            method=self.method
+        )
+
+        held_out = np.zeros(self.values.shape, dtype=bool)
+        for axis, k in enumerate(kept):
+            held_out |= ~k.reshape([-1 if a == axis else 1 for a in range(len(kept))])
+
+        if not held_out.any():
+            raise ValueError("The grid is too coarse for the cross validation")
+
+        indices = np.nonzero(held_out)
+        points = np.column_stack([values[i] for values, i in zip(self.params.values(), indices)])
+
+        self.error = subgrid.validate(points, self.values[indices])
+        return self.error
+
+    def argmax(self, n_starts=5):
+        """
+        Return the point of the maximum of the emulator and the value at it
+        (refined from the best grid points)
+        """
+        starts = np.argsort(self.values, axis=None)[::-1][:n_starts]
+        starts = np.column_stack([
+            values[i] for values, i in zip(self.params.values(), np.unravel_index(starts, self.values.shape))
+        ])
+
+        return self.search(starts)
+
+    def search(self, starts):
+        """
+        Return the best of the local maxima of the emulator found from the starting points and the value at it
+        """
+        best_point, best_value = None, -np.inf
+        width = self.upper - self.lower
+        width[width == 0] = 1.
+
+        for x0 in np.atleast_2d(starts):
+            result = minimize(
+                lambda x: -self(self.lower + width * x)[0], (x0 - self.lower) / width,
+                method='L-BFGS-B', bounds=[(0., 1.)] * len(x0)
+            )
+
+            if -result.fun > best_value:
+                best_point, best_value = self.lower + width * result.x, -result.fun
+
+        return best_point, best_value
+
+    def screen(self, points, n_best=None):
+        """
+        Return the points sorted by the decreasing emulated value (the best n_best of them) and the values
+        """
+        points = np.atleast_2d(points)
+        values = self(points)
+
+        order = np.argsort(np.where(np.isnan(values), -np.inf, values))[::-1][:n_best]
+        return points[order], values[order]
+
+    def save(self, filename):
+        """
+        Save the emulator (e.g., next to the scan result)
+        """
+        with open(filename, 'wb') as file_out:
+            pickle.dump(
+                {
+                    'params': self.params,
+                    'values': self.values,
+                    'method': self.method,
+                    'error': self.error,
+                },
+                file_out
+            )
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Return the emulator saved by save()
+        """
+        with open(filename, 'rb') as file_in:
+            data = pickle.load(file_in)
+
+        emulator = cls(data['params'], data['values'], method=data['method'])
+        emulator.error = data['error']
+        return emulator
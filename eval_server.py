@@ -0,0 +1,255 @@
+"""
+Local evaluation server keeping warm worker processes (Python 3).
+
+The workers import the kinetics, load the spectra and compute the spectral overlaps once at the start,
+so evaluating a small batch of points costs only the propagation itself.
+
+Protocol (JSON lines over a TCP socket on localhost): a request
+
+        {"id": 1, "points": [[pump_energy, dump_energy, pump_width, dump_width, t0_pump, t0_dump], ...],
+         "method": "batch"}
+
+(method is one of 'batch', 'sweep' or 'call', the methods of KineticsProp) is answered by a line
+
+        {"id": 1, "start": 16, "values": [...]}
+
+for each chunk of chunk_size points as soon as it is evaluated (start is the index of its first point),
+followed by {"id": 1, "done": true, "time": <seconds>} or by {"id": 1, "error": "<message>"}.
+The requests sent over one connection are served concurrently, a request longer than max_request_size bytes,
+not valid JSON or not an object with the list of the points is answered by {"id": ..., "error": "<message>"}.
+
+The server is started by
+
+        python eval_server.py <kinetic_params.json> [port]
+"""
+import sys
+import json
+import asyncio
+import socket
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from kinetics_prop import KineticsProp
+import spectra
+import overlap_table
+
+# The kinetics of the worker process
+_kinetics = None
+
+METHODS = ('batch', 'sweep', 'call')
+
+
+def _initialize(loaded_spectra, kinetic_params):
+    """
+    Prepare the kinetics of the worker process (the initializer of the workers)
+    """
+    global _kinetics
+
+    spectra.install(loaded_spectra)
+    _kinetics = KineticsProp(**kinetic_params)
+
+    _kinetics.spectral_overlaps(_kinetics.pump_central, _kinetics.pump_bw)
+    _kinetics.spectral_overlaps(_kinetics.dump_central, _kinetics.dump_bw)
+
+    if _kinetics.spectral_axes:
+        overlap_table.load(_kinetics.spectra_file, _kinetics.model.spectra)
+
+
+def _ready():
+    return _kinetics is not None
+
+
+def _evaluate(method, points):
+    """
+    Return the values at the points computed by the kinetics of the worker process
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+
+    if method == 'call':
+        return [float(_kinetics(tuple(p))) for p in points]
+
+    return np.asarray(getattr(_kinetics, method)(points), dtype=float).tolist()
+
+
+class EvaluationServer(object):
+    """
+    asyncio server evaluating batches of points with a pool of warm worker processes
+    """
+
+    # Number of worker processes
+    n_workers = 4
+
+    # Number of points evaluated by a worker at once (and streamed back in one line)
+    chunk_size = 16
+
+    # Maximal length in bytes of a request line (the buffer limit of the connections, ~500000 points)
+    max_request_size = 2 ** 26
+
+    def __init__(self, kinetic_params, host='127.0.0.1', port=8765, **kwargs):
+        """
+               kinetic_params -- parameters of KineticsProp
+               host, port -- address of the server
+
+         Optional:
+
+               n_workers -- number of worker processes
+               chunk_size -- number of points evaluated by a worker at once
+               max_request_size -- maximal length in bytes of a request line
+        """
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+        self.kinetic_params = kinetic_params
+        self.host = host
+        self.port = port
+
+    async def respond(self, request, writer, lock):
+        """
+        Evaluate the points of the request streaming the chunks of the values as they complete
+        """
+        start = timeit.default_timer()
+        loop = asyncio.get_running_loop()
+
+        async def send(message):
+            await self.send(message, writer, lock)
+
+        try:
+            method = request.get('method', 'batch')
+            if method not in METHODS:
+                raise ValueError("Unknown method '%s' (expected one of %s)" % (method, ', '.join(METHODS)))
+
+            points = request['points']
+
+            async def evaluate(first):
+                values = await loop.run_in_executor(
+                    self.executor, _evaluate, method, points[first:first + self.chunk_size]
+                )
+                await send({'id': request.get('id'), 'start': first, 'values': values})
+
+            await asyncio.gather(*[evaluate(first) for first in range(0, len(points), self.chunk_size)])
+
+        except Exception as error:
+            await send({'id': request.get('id'), 'error': '%s: %s' % (type(error).__name__, error)})
+            return
+
+        await send({'id': request.get('id'), 'done': True, 'time': timeit.default_timer() - start})
+
+    async def send(self, message, writer, lock):
+        """
+        Write the message as a line (the lock keeps the lines of the concurrent requests apart)
+        """
+        async with lock:
+            writer.write((json.dumps(message) + '\n').encode('utf-8'))
+            await writer.drain()
+
+    async def handle(self, reader, writer):
+        """
+        Serve the requests of a connection
+        """
+        lock = asyncio.Lock()
+        tasks = set()
+
+        while True:
+            try:
+                line = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as error:
+                # the last line without the separator
+                line = error.partial
+            except asyncio.LimitOverrunError as error:
+                await self.send({
+                    'id': None, 'error': 'ValueError: Request longer than %d bytes' % self.max_request_size
+                }, writer, lock)
+                await skip_line(reader, error.consumed)
+                continue
+
+            if not line:
+                break
+
+            try:
+                request = json.loads(line)
+            except ValueError as error:
+                await self.send({'id': None, 'error': 'ValueError: Invalid JSON (%s)' % error}, writer, lock)
+                continue
+
+            if not isinstance(request, dict) or not isinstance(request.get('points'), list):
+                await self.send({
+                    'id': request.get('id') if isinstance(request, dict) else None,
+                    'error': 'ValueError: A request is an object with the list of the points'
+                }, writer, lock)
+                continue
+
+            task = asyncio.ensure_future(self.respond(request, writer, lock))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.wait(tasks)
+
+        writer.close()
+
+    async def serve(self):
+        """
+        Start the workers and serve the connections forever
+        """
+        self.executor = ProcessPoolExecutor(
+            self.n_workers, initializer=_initialize, initargs=(spectra.load(), self.kinetic_params)
+        )
+
+        # start all the workers before accepting the connections
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, _ready) for _ in range(self.n_workers)])
+
+        server = await asyncio.start_server(self.handle, self.host, self.port, limit=self.max_request_size)
+
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+async def skip_line(reader, consumed):
+    """
+    Discard the data of the reader up to the next separator (consumed -- the number of bytes
+    known to precede it, see asyncio.LimitOverrunError)
+    """
+    while True:
+        try:
+            await reader.readexactly(consumed)
+            await reader.readuntil(b'\n')
+            return
+        except asyncio.IncompleteReadError:
+            return
+        except asyncio.LimitOverrunError as error:
+            consumed = error.consumed
+
+
+def evaluate(points, method='batch', host='127.0.0.1', port=8765):
+    """
+    Return the values at the points computed by the server (a blocking client)
+    """
+    points = np.atleast_2d(points)
+    values = np.full(len(points), np.nan)
+
+    with socket.create_connection((host, port)) as connection:
+        connection.sendall((json.dumps({'id': 0, 'points': points.tolist(), 'method': method}) + '\n').encode('utf-8'))
+
+        for line in connection.makefile('r'):
+            message = json.loads(line)
+
+            if 'error' in message:
+                raise RuntimeError(message['error'])
+
+            if message.get('done'):
+                return values
+
+            values[message['start']:message['start'] + len(message['values'])] = message['values']
+
+    raise RuntimeError("Connection closed by the server")
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1]) as file_in:
+        kinetic_params = json.load(file_in)
+
+    EvaluationServer(kinetic_params, port=int(sys.argv[2]) if len(sys.argv) > 2 else 8765).run()
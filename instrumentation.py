@@ -0,0 +1,75 @@
+"""
+Opt-in instrumentation of the kinetics engines.
+
+The engines accept a dict stats which, if given, is filled with the counters of the solvers
+
+        nfe -- evaluations of the r.h.s. (of the generator for the batch propagation)
+        nje -- evaluations of the Jacobian
+        nst -- solver steps
+        switches -- switches between the non-stiff (Adams) and stiff (BDF) methods of odeint
+        nmv -- products of the transfer matrix with a vector (iterative steady state of the sparse models)
+
+and with the wall time in seconds of the stages of the computation
+
+        time_spectral -- spectral overlaps and optical couplings
+        time_propagation -- construction of the transfer matrix
+        time_steady_state -- steady state (or iterations) of the transfer matrix.
+
+Nothing is recorded (and nothing is computed) when stats is None.
+"""
+import timeit
+from contextlib import contextmanager
+import numpy as np
+
+# Names of the recorded wall times
+STAGES = ('time_spectral', 'time_propagation', 'time_steady_state')
+
+
+def add(stats, name, value):
+    """
+    Add value to the counter name
+    """
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + value
+
+
+def add_odeint(stats, info):
+    """
+    Add the counters of the odeint solution from its info dict (full_output=True)
+    """
+    if stats is not None:
+        add(stats, 'nfe', info['nfe'][-1])
+        add(stats, 'nje', info['nje'][-1])
+        add(stats, 'nst', info['nst'][-1])
+        add(stats, 'switches', np.count_nonzero(np.diff(info['mused'])))
+
+
+@contextmanager
+def stage(stats, name):
+    """
+    Add the wall time spent within the block to name
+    """
+    if stats is None:
+        yield
+        return
+
+    start = timeit.default_timer()
+    try:
+        yield
+    finally:
+        add(stats, name, timeit.default_timer() - start)
+
+
+def scatter(stats, n_points, members, batch_stats):
+    """
+    Put the stats of the batch of points propagated together into the arrays of the stats of each
+    of the n_points points (the wall times are shared equally, the counters are those of each of the systems)
+    """
+    if stats is None or batch_stats is None:
+        return
+
+    for name, value in batch_stats.items():
+        if name not in stats:
+            stats[name] = np.zeros(n_points)
+
+        stats[name][members] = value / float(len(members)) if name in STAGES else value
@@ -1,7 +1,37 @@
 from types import MethodType, FunctionType
+from collections import OrderedDict
 from scipy.integrate import ode, odeint, simps
 from scipy import linalg
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from scipy.sparse.linalg import LinearOperator, gmres
+from scipy.special import erf
 import numpy as np
+import spectra
+import overlap_table
+import instrumentation
+from steady_state import steady_state
+from rate_model import PHOTOCYCLE
+
+
+def expm_stack(A, order=12):
+    """
+    Return the matrix exponentials of a stack of matrices A (..., n, n)
+    by scaling and squaring of the Taylor series (Horner scheme, matrix products only)
+    """
+    norm = np.abs(A).sum(axis=-2).max()
+    s = int(np.ceil(np.log2(norm / 0.5))) if norm > 0.5 else 0
+    A = A / 2. ** s
+
+    identity = np.eye(A.shape[-1])
+
+    E = identity + A / order
+    for k in range(order - 1, 0, -1):
+        E = identity + np.matmul(A, E) / k
+
+    for _ in range(s):
+        E = np.matmul(E, E)
+
+    return E
 
 
 class KineticsProp:
@@ -9,6 +39,79 @@ class KineticsProp:
     Propagation of kinetic equations
     """
 
+    # Relative amplitude below which the pump and dump pulses are considered switched off.
+    # If specified, the propagation is carried out only over the pulse window and
+    # the pulse free tail is accounted for by the cached matrix exponential of G0.
+    pulse_tol = None
+
+    # Scheme of the transfer matrix construction:
+    #   'columns' -- each column of the transfer matrix is propagated separately
+    #   'matrix' -- the whole propagator is evolved in a single solve of dU/dt = G(t) U
+    #   'final' -- the whole propagator is evolved segment by segment between the pulse edges
+    #              keeping only the final state (see propagate_final)
+    propagator = 'columns'
+
+    # Relative and absolute tolerances of the ODE solvers (the defaults of odeint)
+    rtol = 1.49012e-8
+    atol = 1.49012e-8
+
+    # Method of the 'final' propagator: 'odeint', an integrator of scipy.integrate.ode ('dop853', 'dopri5',
+    # 'lsoda' or 'vode') or 'auto' ('odeint' for the stiff segments and 'dop853' for the others)
+    ode_method = 'auto'
+
+    # Product of the largest rate and the duration of a segment above which the segment is stiff
+    stiffness_threshold = 100.
+
+    # Maximal number of steps per segment of the 'final' propagator
+    max_steps = 100000
+
+    # Maximal number of the unknowns integrated together by the 'final' propagator: the columns of U
+    # are evolved in groups of at most final_size / n columns, so the dense Jacobian has at most final_size ** 2
+    # entries (the whole U of a 210 state model would need (210 ** 2) ** 2 entries, i.e., 15 GB)
+    final_size = 400
+
+    # Number of states above which the generators are kept sparse, the populations are propagated
+    # as vectors with the banded generators of the blocks of the model (see propagate_sparse)
+    # and the steady state is solved iteratively without the transfer matrix (see population_sparse).
+    # Measured on chains of copies of PHOTOCYCLE, the sparse backend is faster than 'columns' and 'final' from ~20 states
+    # (1.2 s vs 17 s at 210 states) and than 'matrix' between 110 (0.8 s vs 0.55 s) and 210 states (out of memory)
+    sparse_threshold = 100
+
+    # Relative tolerance of the iterative steady state of the sparse models
+    # (above the accuracy of the propagation given by rtol and atol)
+    steady_tol = 1e-7
+
+    # The kinetic model (the rate constants are taken from the attributes of the same names)
+    model = PHOTOCYCLE
+
+    # The state whose steady state population is returned
+    observed_state = 'Pfr'
+
+    # The file of the absorption and emission spectra
+    spectra_file = spectra.SPECTRA_FILE
+
+    # Number of points propagated together by batch()
+    batch_size = 1000
+
+    # Time step of the batch propagation (None means 1/20 of the shortest pulse)
+    magnus_dt = None
+
+    # Number of the dark propagators kept in the cache (the least recently used are dropped)
+    # and the number of decimals of tau in ps they are cached by
+    dark_cache_size = 256
+    dark_cache_decimals = 9
+
+    # Parameters of the pulse spectra varied as scan axes (any of 'pump_central', 'pump_bw', 'dump_central',
+    # 'dump_bw'), their values follow the 6 pulse parameters in this order (e.g., 8D points for two of them)
+    # and the spectral overlaps are interpolated from the overlap table
+    spectral_axes = ()
+
+    SPECTRAL_AXES = ('pump_central', 'pump_bw', 'dump_central', 'dump_bw')
+
+    # Dict collecting the solver counters and the stage timings of the current evaluation
+    # (see instrumentation, None means no instrumentation)
+    stats = None
+
     def __init__(self, **kwargs):
         """
          The following parameters are to be specified as arguments:
@@ -17,6 +120,26 @@ class KineticsProp:
                pump_bw -- pump bandwidth in nm
                dump_central -- central wavelength of dump pulse in nm
                dump_bw -- dump bandwidth in nm
+
+         Optional:
+
+               pulse_tol -- relative pulse amplitude defining the end of the pulse window
+                            (None means propagating over the whole t_axis)
+               propagator -- 'columns', 'matrix' or 'final' (see the class attribute)
+               rtol, atol -- tolerances of the ODE solvers
+               ode_method -- method of the 'final' propagator
+               stiffness_threshold -- stiffness of the segments integrated by the stiff method
+               max_steps -- maximal number of steps per segment of the 'final' propagator
+               final_size -- maximal number of the unknowns integrated together by the 'final' propagator
+               batch_size -- number of points propagated together by batch()
+               magnus_dt -- time step of the batch propagation
+               dark_cache_size -- number of the cached dark propagators
+               spectra_file -- csv file of the absorption and emission spectra
+               model -- the kinetic model (rate_model.RateModel)
+               observed_state -- the state whose steady state population is returned
+               sparse_threshold -- number of states above which the sparse backend is used
+               steady_tol -- relative tolerance of the iterative steady state of the sparse models
+               spectral_axes -- parameters of the pulse spectra given with each point (see the class attribute)
         """
 
         # Save all attributes
@@ -29,27 +152,71 @@ class KineticsProp:
             else:
                 setattr(self, name, value)
 
-        # ===========================================================================#
-        # ------------------- READ SPECTRAL PARAMETERS FROM FILE --------------------#
-        # ===========================================================================#
+        self.load_spectra()
 
-        data = np.loadtxt("Cph8_RefSpectra.csv", delimiter=',')
+        for name in self.spectral_axes:
+            if name not in self.SPECTRAL_AXES:
+                raise ValueError(
+                    "Unknown spectral axis '%s' (expected one of %s)" % (name, ', '.join(self.SPECTRAL_AXES))
+                )
 
-        self.lamb = np.array(data[:, 0])
-        self.Pr_abs = np.array(data[:, 1])
-        self.Pr_ems = np.array(data[:, 3])
-        self.Pfr_abs = np.array(data[:, 2])
-        self.Pfr_ems = np.array(data[:, 4])
+        self.beam_area = np.pi * self.beam_diameter ** 2 / 4.
 
         # ===========================================================================#
-        # -------GET ABSORPTION EMISSION DATA OF PR AND PFR STATES BY SCALING--------#
+        # ------------- GENERATOR OF THE DARK KINETICS, OPTICAL COUPLINGS -----------#
         # ===========================================================================#
-        self.Pr_abs *= 60000 / self.Pr_abs.max()
-        self.Pfr_abs *= 50000 / self.Pfr_abs.max()
-        self.Pr_ems *= 60000 / self.Pr_ems.max()
-        self.Pfr_ems *= 50000 / self.Pfr_ems.max()
 
-        self.beam_area = np.pi * self.beam_diameter ** 2 / 4.
+        rates = dict((name, getattr(self, name)) for name in self.model.rates)
+        self.model.check(rates)
+
+        self.sparse = len(self.model) > self.sparse_threshold
+
+        self.G0 = self.model.generator(rates, sparse=self.sparse)
+
+        # unit optical couplings driven by each of the spectra in self.model.spectra
+        self.V_optical = self.model.couplings(sparse=self.sparse)
+
+        # independent blocks of states
+        self.blocks = self.model.blocks()
+
+        # banded forms of the generators of the blocks (see sparse_system)
+        self._sparse_systems = dict()
+
+        # the last steady state of the sparse model (the initial guess of the next one)
+        self._steady_guess = None
+
+        self.t_axis = np.linspace(0., self.T_max, self.T_steps)
+
+        # cache of the dark propagators expm(G0 * tau)
+        self._dark_propagators = OrderedDict()
+
+        # cache of the spectral overlaps
+        self._overlaps = dict()
+
+    # The spectral arrays shared through the spectra store
+    _spectra_attributes = ('lamb', 'Pr_abs', 'Pfr_abs', 'Pr_ems', 'Pfr_ems')
+
+    def load_spectra(self):
+        """
+        Get the (scaled) absorption and emission spectra of the Pr and Pfr states from the spectra store
+        """
+        loaded = spectra.load(self.spectra_file)
+
+        for name in self._spectra_attributes:
+            setattr(self, name, getattr(loaded, name))
+
+    def __getstate__(self):
+        """
+        Pickle without the spectra, the pool workers get them from their spectra store
+        """
+        state = self.__dict__.copy()
+        for name in self._spectra_attributes:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.load_spectra()
 
     def I_pump(self, t):
         return np.exp(-((t - self.t0_pump) / self.pump_width) ** 2)
@@ -57,10 +224,42 @@ class KineticsProp:
     def I_dump(self, t):
         return np.exp(-((t - self.t0_dump) / self.dump_width) ** 2)
 
-    def propagate(self, G0, V_pump, V_dump, p0):
+    def pulse_window(self):
+        """
+        Return the time after which both pulses are below pulse_tol of their peak amplitude
+        """
+        n_widths = np.sqrt(-np.log(self.pulse_tol))
+
+        t_end = max(
+            self.t0_pump + n_widths * self.pump_width,
+            self.t0_dump + n_widths * self.dump_width
+        )
+        return min(t_end, self.T_max)
+
+    def dark_propagator(self, tau):
+        """
+        Return the propagator expm(G0 * tau) of the pulse free kinetics
+        (the last dark_cache_size of them are cached by tau rounded to dark_cache_decimals)
+        """
+        key = round(tau, self.dark_cache_decimals)
+
+        try:
+            # move to the most recently used end
+            U = self._dark_propagators[key] = self._dark_propagators.pop(key)
+        except KeyError:
+            U = self._dark_propagators[key] = linalg.expm(self.G0 * key)
+
+            if len(self._dark_propagators) > self.dark_cache_size:
+                self._dark_propagators.popitem(last=False)
+
+        return U
+
+    def propagate(self, G0, V_pump, V_dump, p0, t_axis=None):
         """
         Propagate a state with withe initial condition p0
         """
+        if t_axis is None:
+            t_axis = self.t_axis
 
         def jac(p, t):
             """
@@ -77,106 +276,682 @@ class KineticsProp:
             """
             return jac(p, t).dot(p)
 
-        return odeint(rhs, p0, self.t_axis, Dfun=jac)
+        if self.stats is None:
+            return odeint(rhs, p0, t_axis, Dfun=jac, rtol=self.rtol, atol=self.atol)
+
+        p, info = odeint(rhs, p0, t_axis, Dfun=jac, rtol=self.rtol, atol=self.atol, full_output=True)
+        instrumentation.add_odeint(self.stats, info)
+        return p
+
+    def propagate_matrix(self, G0, V_pump, V_dump, t_axis=None):
+        """
+        Propagate the propagator U (dU/dt = G(t) U, U = identity initially) in a single solve
+        """
+        if t_axis is None:
+            t_axis = self.t_axis
+
+        n = G0.shape[0]
+        identity = np.eye(n)
+
+        # the last evaluated time and generator
+        cache = [None, None]
+
+        def generator(t):
+            """
+            Return the generator G(t) evaluating it only once per time step
+            """
+            if cache[0] != t:
+                G = V_pump * self.I_pump(t)
+                G += V_dump * self.I_dump(t)
+                G += G0
+                cache[:] = t, G
+            return cache[1]
+
+        def jac(u, t):
+            """
+            Return Jacobian of the flattened (row by row) matrix equations, i.e., G(t) x identity
+            """
+            return np.kron(generator(t), identity)
+
+        def rhs(u, t):
+            """
+            Return the r.h.s. of the flattened matrix equations
+            """
+            return generator(t).dot(u.reshape(n, n)).ravel()
+
+        if self.stats is None:
+            return odeint(rhs, identity.ravel(), t_axis, Dfun=jac, rtol=self.rtol, atol=self.atol).reshape(-1, n, n)
 
-    def __call__(self, parameters):
-        pump_energy, dump_energy, self.pump_width, self.dump_width, self.t0_pump, self.t0_dump = parameters
+        U, info = odeint(
+            rhs, identity.ravel(), t_axis, Dfun=jac, rtol=self.rtol, atol=self.atol, full_output=True
+        )
+        instrumentation.add_odeint(self.stats, info)
+        return U.reshape(-1, n, n)
 
-        pump_spectra = 1. / (np.sqrt(np.pi) * self.pump_bw) \
-            * np.exp(-((self.lamb - self.pump_central) / self.pump_bw) ** 2)
+    def segments(self, t_start, t_end):
+        """
+        Return the list of the segments (start, end, centers, widths) of [t_start, t_end] separated by the pulse edges
+        (where the pulses fall below pulse_tol, or exp(-25), of their peak amplitude), the overlapping pulses
+        share a segment; centers and widths are those of the pulses within the segment (empty between the pulses)
+        """
+        n_widths = np.sqrt(-np.log(self.pulse_tol or np.exp(-25.)))
+        pulses = sorted([
+            (self.t0_pump - n_widths * self.pump_width, self.t0_pump + n_widths * self.pump_width,
+             self.t0_pump, self.pump_width),
+            (self.t0_dump - n_widths * self.dump_width, self.t0_dump + n_widths * self.dump_width,
+             self.t0_dump, self.dump_width),
+        ])
+
+        # merge the overlapping pulses
+        merged = []
+        for first, last, t0, width in pulses:
+            if merged and first < merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], last)
+                merged[-1][2].append(t0)
+                merged[-1][3].append(width)
+            else:
+                merged.append([first, last, [t0], [width]])
 
-        dump_spectra = 1. / (np.sqrt(np.pi) * self.dump_bw) \
-            * np.exp(-((self.lamb - self.dump_central) / self.dump_bw) ** 2)
+        segments = []
+        start = t_start
+        for first, last, centers, widths in merged:
+            first, last = max(first, t_start), min(last, t_end)
+            if first >= last:
+                continue
 
-        self.t_axis = t_axis = np.linspace(0., self.T_max, self.T_steps)
+            if start < first:
+                segments.append((start, first, [], []))
 
-        I_pump = self.I_pump(t_axis)
-        I_dump = self.I_dump(t_axis)
+            segments.append((first, last, [t0 for t0 in centers if first < t0 < last], widths))
+            start = last
 
-        scale_pump = 10.e6 * pump_energy / simps(I_pump, t_axis)  # ASK ZAK
-        scale_dump = 10.e6 * dump_energy / simps(I_dump, t_axis)
+        if start < t_end:
+            segments.append((start, t_end, [], []))
 
-        pump_spectra *= scale_pump
-        dump_spectra *= scale_dump
+        return segments
 
-        K_12_pump = simps(1.92e-9 * pump_spectra * self.lamb * self.Pr_abs / self.beam_area, self.lamb)
-        K_12_dump = simps(1.92e-9 * dump_spectra * self.lamb * self.Pr_abs / self.beam_area, self.lamb)
+    def propagate_final(self, G0, V_pump, V_dump, t_axis=None):
+        """
+        Return the transfer matrix over [t_axis[0], t_axis[-1]] evolving the propagator U
+        (dU/dt = G(t) U, U = identity initially) segment by segment between the pulse edges (see segments).
+
+        Only the final state of each segment is computed. The steps are limited to the pulse width within
+        the pulses, so the solver cannot step over a narrow pulse, and are free elsewhere. With ode_method 'auto',
+        a segment is integrated by odeint (LSODA with the Jacobian) if the largest rate (at its ends and
+        at the pulse centers) times its duration exceeds stiffness_threshold and by the explicit Runge-Kutta
+        method dop853 otherwise. The columns of U are evolved in groups of at most final_size / n columns.
+        """
+        if t_axis is None:
+            t_axis = self.t_axis
 
-        K_34_pump = simps(1.92e-9 * pump_spectra * self.lamb * self.Pr_ems / self.beam_area, self.lamb)
-        K_34_dump = simps(1.92e-9 * dump_spectra * self.lamb * self.Pr_ems / self.beam_area, self.lamb)
+        n = G0.shape[0]
+        identity = np.eye(n)
+        n_groups = -(-n * n // max(self.final_size, n))
 
-        K_67_pump = simps(1.92e-9 * pump_spectra * self.lamb * self.Pfr_abs / self.beam_area, self.lamb)
-        K_67_dump = simps(1.92e-9 * dump_spectra * self.lamb * self.Pfr_abs / self.beam_area, self.lamb)
+        # number of evaluations of the r.h.s. and of the Jacobian by the integrators of scipy.integrate.ode
+        counts = np.zeros(2, dtype=int)
 
-        K_89_pump = simps(1.92e-9 * pump_spectra * self.lamb * self.Pfr_ems / self.beam_area, self.lamb)
-        K_89_dump = simps(1.92e-9 * dump_spectra * self.lamb * self.Pfr_ems / self.beam_area, self.lamb)
+        # the last evaluated time and generator
+        cache = [None, None]
 
+        def generator(t):
+            """
+            Return the generator G(t) evaluating it only once per time step
+            """
+            if cache[0] != t:
+                G = V_pump * self.I_pump(t)
+                G += V_dump * self.I_dump(t)
+                G += G0
+                cache[:] = t, G
+            return cache[1]
+
+        def jac(u, t):
+            """
+            Return Jacobian of the flattened (row by row) matrix equations, i.e., G(t) x identity
+            """
+            return np.kron(generator(t), np.eye(u.size // n))
 
-        ###############################################################################
+        def rhs(u, t):
+            """
+            Return the r.h.s. of the flattened matrix equations
+            """
+            return generator(t).dot(u.reshape(n, -1)).ravel()
 
-        self.G0 = np.zeros([10, 10])
+        def ode_rhs(t, u):
+            counts[0] += 1
+            return rhs(u, t)
 
-        self.G0[0, 3] = self.A_41
-        self.G0[0, 9] = self.A_101
-        self.G0[1, 1] = -self.A_23
-        self.G0[2, 1] = self.A_23
-        self.G0[2, 2] = -self.A_34-self.A_35
-        self.G0[3, 2] = self.A_34
-        self.G0[3, 3] = -self.A_41
-        self.G0[4, 2] = self.A_35
-        self.G0[4, 4] = -self.A_56
-        self.G0[5, 4] = self.A_56
-        self.G0[5, 8] = self.A_96
-        self.G0[6, 6] = -self.A_78
-        self.G0[7, 6] = self.A_78
-        self.G0[7, 7] = -self.A_89 - self.A_810
-        self.G0[8, 7] = self.A_89
-        self.G0[8, 8] = -self.A_96
-        self.G0[9, 7] = self.A_810
-        self.G0[9, 9] = -self.A_101
+        def ode_jac(t, u):
+            counts[1] += 1
+            return jac(u, t)
 
-        self.V_pump = np.zeros_like(self.G0)
-        self.V_dump = np.zeros_like(self.G0)
+        segments = []
 
-        self.V_pump[0, 1] = self.V_pump[1, 0] = K_12_pump
-        self.V_pump[0, 0] = self.V_pump[1, 1] = -K_12_pump
-        self.V_pump[2, 2] = self.V_pump[3, 3] = -K_34_pump
-        self.V_pump[2, 3] = self.V_pump[3, 2] = K_34_pump
+        for start, end, centers, widths in self.segments(t_axis[0], t_axis[-1]):
+            method = self.ode_method
+            max_step = min(widths) if widths else 0.
 
-        self.V_pump[5, 6] = self.V_pump[6, 5] = K_67_pump
-        self.V_pump[5, 5] = self.V_pump[6, 6] = -K_67_pump
-        self.V_pump[7, 7] = self.V_pump[8, 8] = -K_89_pump
-        self.V_pump[7, 8] = self.V_pump[8, 7] = K_89_pump
+            if method == 'auto':
+                # the largest rate of the segment
+                rate = max(np.abs(np.diagonal(generator(t))).max() for t in [start, end] + centers)
+                method = 'odeint' if rate * (end - start) > self.stiffness_threshold else 'dop853'
 
-        self.V_dump[0, 1] = self.V_dump[1, 0] = K_12_dump
-        self.V_dump[0, 0] = self.V_dump[1, 1] = -K_12_dump
-        self.V_dump[2, 2] = self.V_dump[3, 3] = -K_34_dump
-        self.V_dump[2, 3] = self.V_dump[3, 2] = K_34_dump
+            segments.append((start, end, method, max_step))
 
-        self.V_dump[5, 6] = self.V_dump[6, 5] = K_67_dump
-        self.V_dump[5, 5] = self.V_dump[6, 6] = -K_67_dump
-        self.V_dump[7, 7] = self.V_dump[8, 8] = -K_89_dump
-        self.V_dump[7, 8] = self.V_dump[8, 7] = K_89_dump
+        U = np.empty((n, n))
 
-        ###############################################################################
-        #
-        #   Transfer matrix construction
-        #
-        ###############################################################################
-        M = np.transpose(
-            [self.propagate(self.G0, self.V_pump, self.V_dump, e)[-1] for e in np.eye(10)]
-        )
+        for columns in np.array_split(np.arange(n), n_groups):
+            u = identity[:, columns]
+
+            for start, end, method, max_step in segments:
+                if method == 'odeint':
+                    u, info = odeint(
+                        rhs, u.ravel(), [start, end], Dfun=jac, rtol=self.rtol, atol=self.atol,
+                        hmax=max_step, mxstep=self.max_steps, full_output=True
+                    )
+                    instrumentation.add_odeint(self.stats, info)
+                    u = u[-1].reshape(n, -1)
+
+                else:
+                    solver = ode(ode_rhs, ode_jac).set_integrator(
+                        method, rtol=self.rtol, atol=self.atol, max_step=max_step, nsteps=self.max_steps
+                    )
+                    solver.set_initial_value(u.ravel(), start)
+                    u = solver.integrate(end).reshape(n, -1)
+
+                    if not solver.successful():
+                        raise ValueError("Propagation over [%g, %g] by %s failed" % (start, end, method))
+
+            U[:, columns] = u
+
+        instrumentation.add(self.stats, 'nfe', counts[0])
+        instrumentation.add(self.stats, 'nje', counts[1])
+
+        return U
+
+    def sparse_system(self, block):
+        """
+        Return the banded form of the generators restricted to the states of the block (cached):
+        the states of the block in the reverse Cuthill-McKee order (minimizing the bandwidth), the numbers
+        of the lower and upper diagonals ml, mu, and the csr pattern of the generators in this order
+        (its data are overwritten by the generator at each time)
+        """
+        key = tuple(block)
+
+        try:
+            return self._sparse_systems[key]
+        except KeyError:
+            pass
+
+        pattern = sum(abs(G[block][:, block]) for G in [self.G0] + list(self.V_optical)).tocsr()
+        order = np.asarray(block)[reverse_cuthill_mckee(pattern, symmetric_mode=False)]
+
+        pattern = sum(abs(G[order][:, order]) for G in [self.G0] + list(self.V_optical)).tocsr()
+        pattern.sort_indices()
+
+        # positions of the entries of pattern.data
+        rows, cols = np.repeat(np.arange(len(order)), np.diff(pattern.indptr)), pattern.indices
+        ml, mu = max(0, (rows - cols).max(initial=0)), max(0, (cols - rows).max(initial=0))
+
+        system = self._sparse_systems[key] = order, ml, mu, pattern
+        return system
+
+    def propagate_sparse(self, P, block, t_start, t_end, pulses=True):
+        """
+        Return the populations P of the states of the block (in the order of sparse_system, a vector
+        or an array of column vectors) propagated from t_start to t_end (without the pulses if pulses is False).
+
+        Each vector is propagated by odeint (LSODA) segment by segment between the pulse edges
+        with the banded Jacobian, so that the cost of a step scales with the number of transitions
+        (times the bandwidth of the block when the Jacobian is factorized) and no transfer matrix is formed.
+        """
+        order, ml, mu, G = self.sparse_system(block)
+        rows, cols = np.repeat(np.arange(len(order)), np.diff(G.indptr)), G.indices
+
+        def values(A):
+            return np.asarray(A[order][:, order][rows, cols]).ravel()
+
+        g0 = values(self.G0)
+        if pulses:
+            v_pump, v_dump = values(self.V_pump), values(self.V_dump)
+
+        # the last evaluated time
+        cache = [None]
+
+        def generator(t):
+            """
+            Return the generator G(t) of the block evaluating it only once per time step
+            """
+            if cache[0] != t:
+                G.data[:] = g0
+                if pulses:
+                    G.data += self.I_pump(t) * v_pump
+                    G.data += self.I_dump(t) * v_dump
+                cache[0] = t
+            return G
+
+        def jac(p, t):
+            """
+            Return the Jacobian of the rate equations, i.e., G(t) in the band storage of odeint
+            """
+            J = np.zeros((ml + mu + 1, len(order)))
+            J[rows - cols + mu, cols] = generator(t).data
+            return J
+
+        def rhs(p, t):
+            return generator(t).dot(p)
+
+        if pulses:
+            segments = self.segments(t_start, t_end)
+        else:
+            segments = [(t_start, t_end, [], [])]
+
+        P = np.array(P, dtype=float)
+        columns = P.reshape(len(order), -1)
+
+        for k in range(columns.shape[1]):
+            p = columns[:, k]
+
+            if not p.any():
+                continue
+
+            for start, end, _, widths in segments:
+                p, info = odeint(
+                    rhs, p, [start, end], Dfun=jac, ml=ml, mu=mu, rtol=self.rtol, atol=self.atol,
+                    hmax=min(widths) if widths else 0., mxstep=self.max_steps, full_output=True
+                )
+                instrumentation.add_odeint(self.stats, info)
+                p = p[-1]
+
+            columns[:, k] = p
+
+        return P
+
+    def population_sparse(self):
+        """
+        Return the population of the observed state in the steady state of the kinetics over [0, T_max]
+        for the sparse models.
+
+        The steady state of the block of the observed state (normalized within the block) is solved by GMRES
+        applying the transfer matrix M as an operator (a propagation of a vector by propagate_sparse),
+        the equations (M - 1) v = 0 with one of them replaced by sum(v) = 1 as in steady_state.
+        The residual max|M v - v| is kept in self.residual.
+        """
+        index = self.model.index(self.observed_state)
+        block = next(block for block in self.blocks if index in block)
+
+        order = self.sparse_system(block)[0]
+        n = len(order)
+
+        def residual(v):
+            r = self.propagate_sparse(v, block, 0., self.T_max) - v
+            instrumentation.add(self.stats, 'nmv', 1)
+            return r
+
+        def matvec(v):
+            r = residual(np.ravel(v))
+            r[-1] = np.sum(v)
+            return r
+
+        b = np.zeros(n)
+        b[-1] = 1.
+
+        x0 = self._steady_guess
+        if x0 is None or len(x0) != n:
+            x0 = np.full(n, 1. / n)
+
+        A = LinearOperator((n, n), matvec=matvec, dtype=float)
+
+        try:
+            v, info = gmres(A, b, x0=x0, rtol=self.steady_tol, atol=0., restart=n)
+        except TypeError:
+            # scipy < 1.12
+            v, info = gmres(A, b, x0=x0, tol=self.steady_tol, atol=0., restart=n)
+
+        if info != 0:
+            raise ValueError("The steady state of the sparse model did not converge (GMRES info %d)" % info)
+
+        self._steady_guess = v
+        self.residual = np.abs(residual(v)).max()
+
+        return float(v[list(order).index(index)])
+
+    def propagate_dark(self, tau, M):
+        """
+        Return expm(G0 * tau).dot(M), i.e., M followed by the pulse free kinetics over the time tau
+        """
+        if self.sparse:
+            M = np.array(M, dtype=float)
+
+            for block in self.blocks:
+                order = self.sparse_system(block)[0]
+                M[order] = self.propagate_sparse(M[order], block, 0., tau, pulses=False)
+
+            return M
+
+        return self.dark_propagator(tau).dot(M)
+
+    def transfer_matrix(self, t_axis):
+        """
+        Return the transfer matrix of the kinetics over t_axis
+        """
+        if self.sparse:
+            M = np.zeros(self.G0.shape)
+
+            for block in self.blocks:
+                order = self.sparse_system(block)[0]
+                M[np.ix_(order, order)] = self.propagate_sparse(
+                    np.eye(len(order)), block, t_axis[0], t_axis[-1]
+                )
+
+            return M
+
+        elif self.propagator == 'matrix':
+            return self.propagate_matrix(self.G0, self.V_pump, self.V_dump, t_axis)[-1]
+
+        elif self.propagator == 'final':
+            return self.propagate_final(self.G0, self.V_pump, self.V_dump, t_axis)
+
+        elif self.propagator == 'columns':
+            return np.transpose(
+                [self.propagate(self.G0, self.V_pump, self.V_dump, e, t_axis)[-1] for e in np.eye(len(self.G0))]
+            )
+
+        else:
+            raise ValueError("Unknown propagator '%s'" % self.propagator)
+
+    def pulse_norm(self, t0, width):
+        """
+        Return the integral of the Gaussian pulse intensity over [0, T_max]
+        """
+        return 0.5 * np.sqrt(np.pi) * width * (erf((self.T_max - t0) / width) + erf(t0 / width))
+
+    def spectral_overlaps(self, central, bw):
+        """
+        Return the overlaps of the Gaussian pulse spectrum (per unit of the pulse fluence)
+        with the spectra of self.model (cached for each central wavelength and bandwidth)
+        """
+        try:
+            return self._overlaps[central, bw]
+        except KeyError:
+            pulse_spectra = 1. / (np.sqrt(np.pi) * bw) * np.exp(-((self.lamb - central) / bw) ** 2)
+            pulse_spectra *= 10.e6 * 1.92e-9 * self.lamb / self.beam_area  # ASK ZAK
+
+            overlaps = self._overlaps[central, bw] = np.array([
+                simps(pulse_spectra * getattr(self, name), self.lamb) for name in self.model.spectra
+            ])
+            return overlaps
+
+    def pulse_overlaps(self, parameters):
+        """
+        Return the spectral overlaps of the pump and dump pulses for parameters of shape (6 + len(spectral_axes),)
+        or (N, 6 + len(spectral_axes))
+        """
+        if not self.spectral_axes:
+            return self.spectral_overlaps(self.pump_central, self.pump_bw), \
+                self.spectral_overlaps(self.dump_central, self.dump_bw)
+
+        pulse_spectra = dict((name, getattr(self, name)) for name in self.SPECTRAL_AXES)
+        pulse_spectra.update(zip(self.spectral_axes, np.moveaxis(parameters[..., 6:], -1, 0)))
+
+        table = overlap_table.load(self.spectra_file, self.model.spectra)
+        scale = 10.e6 * 1.92e-9 / self.beam_area  # as in spectral_overlaps
+
+        return scale * table(pulse_spectra['pump_central'], pulse_spectra['pump_bw']), \
+            scale * table(pulse_spectra['dump_central'], pulse_spectra['dump_bw'])
+
+    def couplings(self, parameters):
+        """
+        Return the optical coupling matrices V_pump and V_dump for parameters of shape (6,) or (N, 6)
+        (followed by the values of the spectral_axes)
+        """
+        parameters = np.asarray(parameters, dtype=float)
+
+        if parameters.shape[-1] != 6 + len(self.spectral_axes):
+            raise ValueError(
+                "Expected %d parameters per point, got %d" % (6 + len(self.spectral_axes), parameters.shape[-1])
+            )
+
+        pump_energy, dump_energy, pump_width, dump_width, t0_pump, t0_dump = np.moveaxis(parameters[..., :6], -1, 0)
+        overlaps_pump, overlaps_dump = self.pulse_overlaps(parameters)
+
+        # rate constants of the optical transitions (K_12, K_34, K_67 and K_89)
+        K_pump = (pump_energy / self.pulse_norm(t0_pump, pump_width))[..., np.newaxis] * overlaps_pump
+
+        K_dump = (dump_energy / self.pulse_norm(t0_dump, dump_width))[..., np.newaxis] * overlaps_dump
+
+        if self.sparse:
+            return sum(k * V for k, V in zip(K_pump, self.V_optical)), \
+                sum(k * V for k, V in zip(K_dump, self.V_optical))
+
+        return np.tensordot(K_pump, self.V_optical, axes=1), np.tensordot(K_dump, self.V_optical, axes=1)
+
+    def set_pulses(self, parameters):
+        """
+        Set the pulse parameters and construct the optical coupling matrices V_pump and V_dump
+        """
+        _, _, self.pump_width, self.dump_width, self.t0_pump, self.t0_dump = parameters[:6]
+        self.V_pump, self.V_dump = self.couplings(parameters)
+
+    def __call__(self, parameters, stats=None):
+        """
+        Return the population of the observed state for the parameters
+        (stats -- dict to be filled with the solver counters and the stage timings, see instrumentation)
+        """
+        self.stats = stats
+
+        try:
+            with instrumentation.stage(stats, 'time_spectral'):
+                self.set_pulses(parameters)
+            t_axis = self.t_axis
+
+            ###############################################################################
+            #
+            #   Transfer matrix construction
+            #
+            ###############################################################################
+            if self.sparse:
+                # the propagations are the matrix-vector products of the iterative steady state
+                with instrumentation.stage(stats, 'time_steady_state'):
+                    return self.population_sparse()
+
+            with instrumentation.stage(stats, 'time_propagation'):
+                if self.pulse_tol is None:
+                    M = self.transfer_matrix(t_axis)
+                else:
+                    # propagate through the pulses only
+                    t_end = self.pulse_window()
+                    t_window = np.append(t_axis[t_axis < t_end], t_end)
+
+                    # the rest is the dark kinetics
+                    M = self.propagate_dark(self.T_max - t_end, self.transfer_matrix(t_window))
+
+            # print M.sum(axis=0)
+
+            np.set_printoptions(precision=2, suppress=True)
+            # print M
+
+            with instrumentation.stage(stats, 'time_steady_state'):
+                return self.population(M)
+        finally:
+            self.stats = None
+
+    def population(self, M):
+        """
+        Return the population of the observed state in the steady state of the transfer matrix M
+        (a float, or an array for a stack of them). The residual of the steady state is kept in self.residual.
+        """
+        v, self.residual = steady_state(M, return_residual=True)
+        #print v
+        population = v[..., self.model.index(self.observed_state)]
+
+        return float(population) if np.ndim(population) == 0 else population
+
+    def transfer_matrix_batch(self, parameters):
+        """
+        Return the transfer matrices for an (N, 6) array of parameters.
+
+        All the N systems are propagated together through the common pulse window
+        by the fourth order Magnus integrator with a fixed time step,
+        the pulse free tail is accounted for by the dark propagator.
+        """
+        parameters = np.asarray(parameters, dtype=float)
+
+        with instrumentation.stage(self.stats, 'time_spectral'):
+            V_pump, V_dump = self.couplings(parameters)
+
+        pump_width, dump_width, t0_pump, t0_dump = parameters[:, 2:6, np.newaxis, np.newaxis].transpose(1, 0, 2, 3)
+
+        if self.pulse_tol is None:
+            t_end = self.T_max
+        else:
+            n_widths = np.sqrt(-np.log(self.pulse_tol))
+            t_end = min(self.T_max, max(
+                (t0_pump + n_widths * pump_width).max(), (t0_dump + n_widths * dump_width).max()
+            ))
+
+        def generator(t):
+            G = V_pump * np.exp(-((t - t0_pump) / pump_width) ** 2)
+            G += V_dump * np.exp(-((t - t0_dump) / dump_width) ** 2)
+            G += self.G0
+            return G
+
+        dt = self.magnus_dt or min(pump_width.min(), dump_width.min()) / 20.
+
+        with instrumentation.stage(self.stats, 'time_propagation'):
+            U = self.magnus(generator, len(parameters), t_end, dt)
+
+            return np.matmul(self.dark_propagator(self.T_max - t_end), U)
+
+    def transfer_matrix_sweep(self, pump_energy, dump_energy, pulses):
+        """
+        Return the transfer matrices for the arrays of pump_energy and dump_energy
+        sharing the rest of the parameters pulses = (pump_width, dump_width, t0_pump, t0_dump)
+        (followed by the values of the spectral_axes).
+
+        The pulse normalizations, the pulse window, the intensities at each time step
+        and the dark propagator are computed once for all the points.
+        """
+        with instrumentation.stage(self.stats, 'time_spectral'):
+            self.set_pulses(np.concatenate([[1., 1.], pulses]))
+
+        V_pump = np.multiply.outer(pump_energy, self.V_pump)
+        V_dump = np.multiply.outer(dump_energy, self.V_dump)
+
+        t_end = self.T_max if self.pulse_tol is None else self.pulse_window()
+
+        def generator(t):
+            G = V_pump * self.I_pump(t)
+            G += V_dump * self.I_dump(t)
+            G += self.G0
+            return G
+
+        dt = self.magnus_dt or min(self.pump_width, self.dump_width) / 20.
+
+        with instrumentation.stage(self.stats, 'time_propagation'):
+            U = self.magnus(generator, len(V_pump), t_end, dt)
+
+            return np.matmul(self.dark_propagator(self.T_max - t_end), U)
+
+    def magnus(self, generator, n_systems, t_end, dt):
+        """
+        Return the propagators over [0, t_end] of n_systems driven by the stacked generators generator(t)
+        by the fourth order Magnus integrator with a fixed time step (at most dt)
+        """
+        n_steps = max(1, int(np.ceil(t_end / dt)))
+        dt = t_end / n_steps
+
+        # Gauss-Legendre nodes within a step
+        c1, c2 = 0.5 - np.sqrt(3.) / 6., 0.5 + np.sqrt(3.) / 6.
+
+        U = np.tile(np.eye(len(self.G0)), (n_systems, 1, 1))
+
+        instrumentation.add(self.stats, 'nst', n_steps)
+        instrumentation.add(self.stats, 'nfe', 2 * n_steps)
+
+        for t in np.arange(n_steps) * dt:
+            G1 = generator(t + c1 * dt)
+            G2 = generator(t + c2 * dt)
+
+            Omega = G1 + G2
+            Omega *= 0.5 * dt
+            Omega += np.sqrt(3.) / 12. * dt ** 2 * (np.matmul(G2, G1) - np.matmul(G1, G2))
+
+            U = np.matmul(expm_stack(Omega), U)
+
+        return U
+
+    def sweep(self, parameters, stats=None):
+        """
+        Return the results for an (N, 6) array of parameters in which groups of points
+        differ only by the pulse energies (e.g., work units of a scan varying the energies fastest).
+        Each group shares the time profile quantities (see transfer_matrix_sweep),
+        large sparse models are propagated point by point (see batch).
+
+        stats -- dict to be filled with the arrays of the solver counters and the stage timings of each point
+        """
+        parameters = np.atleast_2d(np.asarray(parameters, dtype=float))
+
+        if self.sparse:
+            return self.batch(parameters, stats=stats)
+
+        pulses, group = np.unique(parameters[:, 2:], axis=0, return_inverse=True)
+        group = group.ravel()
+
+        population = np.empty(len(parameters))
+        residual = np.empty_like(population)
+
+        for g, pulses_ in enumerate(pulses):
+            members = np.flatnonzero(group == g)
+            self.stats = None if stats is None else dict()
+
+            M = self.transfer_matrix_sweep(parameters[members, 0], parameters[members, 1], pulses_)
+
+            with instrumentation.stage(self.stats, 'time_steady_state'):
+                population[members] = self.population(M)
+            residual[members] = self.residual
+
+            instrumentation.scatter(stats, len(parameters), members, self.stats)
+
+        self.residual = residual
+        self.stats = None
+
+        return population
+
+    def batch(self, parameters, batch_size=None, stats=None):
+        """
+        Return the results for an (N, 6) array of parameters propagating batch_size of them at once
+        (large sparse models are propagated point by point)
+
+        stats -- dict to be filled with the arrays of the solver counters and the stage timings of each point
+        """
+        parameters = np.atleast_2d(parameters)
+        batch_size = 1 if self.sparse else batch_size or self.batch_size
+
+        population = np.empty(len(parameters))
+        residual = np.empty_like(population)
+
+        for n in range(0, len(parameters), batch_size):
+            members = np.arange(n, min(n + batch_size, len(parameters)))
+            point_stats = None if stats is None else dict()
+
+            if self.sparse:
+                population[n] = self(parameters[n], stats=point_stats)
+            else:
+                self.stats = point_stats
+                M = self.transfer_matrix_batch(parameters[members])
+
+                with instrumentation.stage(self.stats, 'time_steady_state'):
+                    population[members] = self.population(M)
 
-        # print M.sum(axis=0)
+            residual[members] = self.residual
 
-        np.set_printoptions(precision=2, suppress=True)
-        # print M
+            instrumentation.scatter(stats, len(parameters), members, point_stats)
 
-        vals, vecs = linalg.eig(M)
+        self.residual = residual
+        self.stats = None
 
-        v = vecs[:, np.abs(vals - 1).argmin()]
-        #print v.real / v.real.sum()
-        return v[5].real / v.real.sum()
+        return population
 
 ####################################################################################################
 #
@@ -189,7 +964,7 @@ if __name__=='__main__':
 
     print(KineticsProp.__doc__)
 
-    print KineticsProp(
+    print(KineticsProp(
         # Pulses characterization
         pump_central=625.,
         pump_bw=40.,
@@ -217,4 +992,4 @@ if __name__=='__main__':
         Iterations=51,
     )(
         (0.25, 2.0, .100, .150, 0.5, 0.5251)
-    )
\ No newline at end of file
+    ))
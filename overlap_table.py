@@ -0,0 +1,94 @@
+"""
+Lookup table of the overlaps of Gaussian pulse spectra with the absorption and emission spectra.
+
+The overlap of the normalized Gaussian spectrum of a pulse (central wavelength, bandwidth) with each spectrum,
+
+        integral exp(-((lamb - central) / bw) ** 2) / (sqrt(pi) * bw) * lamb * spectrum(lamb) d lamb,
+
+is tabulated over a dense grid of the central wavelengths and bandwidths (by the same Simpson rule
+as KineticsProp.spectral_overlaps) and interpolated by bicubic splines, so the pulse spectra
+can be scan axes without integrating over the wavelengths for every point.
+"""
+import os
+import numpy as np
+from scipy.integrate import simps
+from scipy.interpolate import RectBivariateSpline
+import spectra
+
+# Default grid of the table: central wavelengths in nm (the range of the spectra file is used if None)
+# and bandwidths in nm
+CENTER_STEP = 1.
+BANDWIDTHS = np.geomspace(2., 200., 100)
+
+# Loaded tables for each (file, spectra, grid)
+_store = dict()
+
+
+class OverlapTable(object):
+    """
+    Interpolated overlaps of the Gaussian pulse spectra with a set of spectra
+    """
+
+    def __init__(self, lamb, spectra_, centers, bandwidths):
+        """
+               lamb -- wavelengths of the spectra
+               spectra_ -- list of the spectra sampled at lamb
+               centers -- grid of the central wavelengths of the pulses
+               bandwidths -- grid of the bandwidths of the pulses
+        """
+        self.centers = np.asarray(centers, dtype=float)
+        self.bandwidths = np.asarray(bandwidths, dtype=float)
+
+        # weights of the Simpson rule over lamb (the integral is linear in the integrand)
+        weights = simps(np.eye(len(lamb)), lamb)
+        weighted = np.transpose(spectra_) * (weights * lamb)[:, np.newaxis]
+
+        # table[center, bandwidth, spectrum]
+        table = np.empty((len(self.centers), len(self.bandwidths), len(spectra_)))
+
+        for i, central in enumerate(self.centers):
+            pulse_spectra = np.exp(-((lamb - central) / self.bandwidths[:, np.newaxis]) ** 2)
+            pulse_spectra /= np.sqrt(np.pi) * self.bandwidths[:, np.newaxis]
+            table[i] = pulse_spectra.dot(weighted)
+
+        self.table = table
+        self.splines = [
+            RectBivariateSpline(self.centers, self.bandwidths, table[..., k]) for k in range(len(spectra_))
+        ]
+
+    def __call__(self, central, bw):
+        """
+        Return the overlaps for the arrays of central wavelengths and bandwidths (of shape (..., number of spectra))
+        """
+        central, bw = np.broadcast_arrays(np.asarray(central, dtype=float), np.asarray(bw, dtype=float))
+
+        if (central < self.centers[0]).any() or (central > self.centers[-1]).any() \
+                or (bw < self.bandwidths[0]).any() or (bw > self.bandwidths[-1]).any():
+            raise ValueError(
+                "Pulse spectrum outside of the overlap table (central wavelength %g-%g nm, bandwidth %g-%g nm)" % (
+                    self.centers[0], self.centers[-1], self.bandwidths[0], self.bandwidths[-1]
+                )
+            )
+
+        return np.stack([spline.ev(central, bw) for spline in self.splines], axis=-1)
+
+
+def load(filename=spectra.SPECTRA_FILE, names=('Pr_abs', 'Pr_ems', 'Pfr_abs', 'Pfr_ems'),
+         centers=None, bandwidths=BANDWIDTHS):
+    """
+    Return the overlap table of the (scaled) spectra of the given names (built once per process)
+    """
+    loaded = spectra.load(filename)
+
+    if centers is None:
+        centers = np.arange(np.ceil(loaded.lamb.min()), np.floor(loaded.lamb.max()) + CENTER_STEP / 2, CENTER_STEP)
+
+    key = (os.path.abspath(filename), tuple(names), tuple(centers), tuple(bandwidths))
+
+    try:
+        return _store[key]
+    except KeyError:
+        table = _store[key] = OverlapTable(
+            loaded.lamb, [getattr(loaded, name) for name in names], centers, bandwidths
+        )
+        return table
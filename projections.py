@@ -0,0 +1,207 @@
+"""
+Pairwise projections of 6D scans for the visualization.
+
+All the maps over the pairs of axes (the mean and the maximum of the valid values over the other axes,
+and the grid point where the maximum is reached) are accumulated in a single pass over the scan,
+which is read block by block (a ScanStore, a memory-mapped or an ordinary array),
+so the memory needed does not depend on the size of the scan.
+The values outside of the valid range (populations not in [0, 1]) are ignored.
+"""
+import os
+import warnings
+from itertools import combinations
+import numpy as np
+from scan_store import ScanStore, CHUNK_POINTS, VALID_RANGE
+
+
+def iter_blocks(scan, block_points=CHUNK_POINTS):
+    """
+    Yield the slices of the grid and the blocks of the scan (a ScanStore or an array) covering the whole grid
+    """
+    if isinstance(scan, ScanStore):
+        for slices, block in scan.iter_chunks():
+            yield slices, block
+        return
+
+    # blocks of whole subarrays along the first axis
+    step = max(1, block_points // max(1, int(np.prod(scan.shape[1:]))))
+
+    for start in range(0, scan.shape[0], step):
+        slices = (slice(start, min(start + step, scan.shape[0])),) + tuple(slice(0, n) for n in scan.shape[1:])
+        yield slices, np.asarray(scan[slices[0]])
+
+
+class Projections(object):
+    """
+    Maps of the mean, maximum and the position of the maximum over each pair of axes
+    """
+
+    def __init__(self, shape, valid_range=VALID_RANGE):
+        """
+               shape -- shape of the scan
+               valid_range -- (min, max) of the valid values
+        """
+        self.shape = tuple(shape)
+        self.valid_range = valid_range
+        self.pairs = list(combinations(range(len(shape)), 2))
+
+        self.total = dict()
+        self.count = dict()
+        self.max = dict()
+        self.argmax = dict()
+
+        for pair in self.pairs:
+            map_shape = tuple(self.shape[axis] for axis in pair)
+            self.total[pair] = np.zeros(map_shape)
+            self.count[pair] = np.zeros(map_shape, dtype=int)
+            self.max[pair] = np.full(map_shape, -np.inf)
+            self.argmax[pair] = np.full(map_shape, -1, dtype=int)
+
+        # range of all the valid values
+        self.vmin = np.inf
+        self.vmax = -np.inf
+
+    def update(self, slices, block):
+        """
+        Accumulate the block of the scan covering the given slices of the grid
+        """
+        block = np.asarray(block, dtype=float)
+        valid = (block >= self.valid_range[0]) & (block <= self.valid_range[1])
+
+        if not valid.any():
+            return
+
+        self.vmin = min(self.vmin, block[valid].min())
+        self.vmax = max(self.vmax, block[valid].max())
+
+        values = np.where(valid, block, 0.)
+        highest = np.where(valid, block, -np.inf)
+
+        for pair in self.pairs:
+            other = tuple(axis for axis in range(block.ndim) if axis not in pair)
+            target = tuple(slices[axis] for axis in pair)
+
+            self.total[pair][target] += values.sum(axis=other)
+            self.count[pair][target] += valid.sum(axis=other)
+
+            # position of the maximum within the block over the other axes
+            moved = np.moveaxis(highest, pair, (0, 1))
+            moved = moved.reshape(moved.shape[:2] + (-1,))
+            local = moved.argmax(axis=-1)
+            block_max = np.take_along_axis(moved, local[..., np.newaxis], axis=-1)[..., 0]
+
+            better = block_max > self.max[pair][target]
+            if not better.any():
+                continue
+
+            # flat index of the maximum in the whole grid
+            i, j = np.nonzero(better)
+            multi_index = [None] * block.ndim
+            multi_index[pair[0]] = i + slices[pair[0]].start
+            multi_index[pair[1]] = j + slices[pair[1]].start
+
+            for axis, index in zip(other, np.unravel_index(local[i, j], [block.shape[axis] for axis in other])):
+                multi_index[axis] = index + slices[axis].start
+
+            self.max[pair][target][better] = block_max[better]
+            self.argmax[pair][target][better] = np.ravel_multi_index(multi_index, self.shape)
+
+    def mean(self, pair):
+        """
+        Return the mean of the valid values over the axes other than pair (NaN if there are none)
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.where(self.count[pair] > 0, self.total[pair] / self.count[pair], np.nan)
+
+    def maximum(self, pair):
+        """
+        Return the maximum of the valid values over the axes other than pair (NaN if there are none)
+        """
+        return np.where(np.isfinite(self.max[pair]), self.max[pair], np.nan)
+
+    def position(self, pair):
+        """
+        Return the multi-indices (one array per axis) of the grid points where the maxima are reached
+        """
+        return np.unravel_index(np.maximum(self.argmax[pair], 0), self.shape)
+
+    def best(self):
+        """
+        Return the multi-index of the maximum of the valid values over the whole grid
+        """
+        pair = self.pairs[0]
+        return np.unravel_index(self.argmax[pair].flat[np.argmax(self.max[pair])], self.shape)
+
+
+def project_all(scan, valid_range=VALID_RANGE, block_points=CHUNK_POINTS):
+    """
+    Return the Projections of the scan (a ScanStore or an array) computed in a single pass
+    """
+    projections = Projections(scan.shape, valid_range)
+
+    for slices, block in iter_blocks(scan, block_points):
+        projections.update(slices, block)
+
+    return projections
+
+
+def render_map(filename, image, extent, xlabel, ylabel, vmin, vmax):
+    """
+    Save the 2D map as a PNG image (runs in the worker processes)
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure()
+
+    x_min, x_max, y_min, y_max = extent
+
+    plt.imshow(
+        image.T,
+        origin='lower',
+        interpolation='nearest',
+        extent=[x_min, x_max, y_min, y_max],
+        aspect=(x_max - x_min) / (y_max - y_min),
+        vmin=vmin,
+        vmax=vmax
+    )
+
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+
+    plt.colorbar()
+    plt.savefig(filename)
+    plt.close(figure)
+
+
+def _render_map(args):
+    return render_map(*args)
+
+
+def render(projections, params, axes_names, directory, statistic='mean', pool=None):
+    """
+    Save the maps of the statistic ('mean' or 'maximum') of all the pairs of axes
+    as directory/scan_<i>_<j>.png (in parallel if the pool is given)
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tasks = []
+
+    for pair in projections.pairs:
+        xlabel, ylabel = axes_names[pair[0]], axes_names[pair[1]]
+
+        tasks.append((
+            os.path.join(directory, 'scan_%d_%d.png' % pair),
+            getattr(projections, statistic)(pair),
+            (params[xlabel].min(), params[xlabel].max(), params[ylabel].min(), params[ylabel].max()),
+            xlabel, ylabel,
+            projections.vmin, projections.vmax
+        ))
+
+    if pool is None:
+        list(map(_render_map, tasks))
+    else:
+        pool.map(_render_map, tasks)
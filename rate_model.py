@@ -0,0 +1,216 @@
+"""
+Declarative definition of the kinetic (rate equation) models.
+
+A model is specified by its states, the table of the dark transitions with the names of their rate constants,
+and the table of the optically driven pairs of states with the names of the spectra driving them.
+It is compiled into the generator of the dark kinetics G0, the unit optical couplings V (one for each spectrum)
+and the array-returning r.h.s. and Jacobian of the rate equations
+
+        dp/dt = G(t) p,     G(t) = G0 + sum_{pulse, spectrum} I_pulse(t) K[pulse, spectrum] V[spectrum],
+
+where I_pulse(t) = exp(-((t - t0_pulse) / width_pulse) ** 2) is the intensity of a Gaussian pulse.
+"""
+import hashlib
+import numpy as np
+from scipy import sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+
+class RateModel(object):
+    """
+    Kinetic model compiled from the tables of transitions
+    """
+
+    def __init__(self, states, dark, optical):
+        """
+               states -- list of the names of the states
+               dark -- list of (initial state, final state, name of the rate constant) of the dark transitions
+               optical -- list of (state, state, name of the spectrum) of the optically driven pairs
+        """
+        self.states = list(states)
+        self.dark = list(dark)
+        self.optical = list(optical)
+
+        if len(set(self.states)) != len(self.states):
+            raise ValueError("Duplicate state names")
+
+        for transition in self.dark + self.optical:
+            for state in transition[:2]:
+                if state not in self.states:
+                    raise ValueError("Unknown state '%s' in the transition %s" % (state, transition))
+
+        # names of the rate constants and of the spectra in the order of their first appearance
+        self.rates = unique(name for _, _, name in self.dark)
+        self.spectra = unique(name for _, _, name in self.optical)
+
+    def __len__(self):
+        return len(self.states)
+
+    def digest(self):
+        """
+        Return the SHA-1 hash of the definition of the model
+        """
+        return hashlib.sha1(repr((self.states, self.dark, self.optical)).encode('utf-8')).hexdigest()
+
+    def index(self, state):
+        """
+        Return the index of the state
+        """
+        return self.states.index(state)
+
+    def generator(self, rates, sparse=False):
+        """
+        Return the generator of the dark kinetics G0 for the given rate constants {name: value}
+        """
+        try:
+            values = [rates[name] for _, _, name in self.dark]
+        except KeyError as error:
+            raise ValueError("The rate constant %s is not specified" % error)
+
+        initial = [self.index(i) for i, _, _ in self.dark]
+        final = [self.index(f) for _, f, _ in self.dark]
+
+        # gain of the final state and loss of the initial state
+        G0 = sp.coo_matrix(
+            (np.concatenate([values, np.negative(values)]), (final + initial, initial + initial)),
+            shape=(len(self), len(self))
+        ).tocsr()
+
+        return G0 if sparse else G0.toarray()
+
+    def couplings(self, sparse=False):
+        """
+        Return the unit optical couplings V, one for each spectrum in self.spectra
+        (an array of shape (len(self.spectra), n, n) or a list of sparse matrices)
+        """
+        V = []
+
+        for spectrum in self.spectra:
+            pairs = [(self.index(i), self.index(j)) for i, j, name in self.optical if name == spectrum]
+            i, j = map(list, zip(*pairs))
+
+            # symmetric exchange of the populations
+            V.append(sp.coo_matrix(
+                ([1.] * 2 * len(pairs) + [-1.] * 2 * len(pairs), (i + j + i + j, j + i + i + j)),
+                shape=(len(self), len(self))
+            ).tocsr())
+
+        return V if sparse else np.array([v.toarray() for v in V])
+
+    def blocks(self):
+        """
+        Return the arrays of the indices of the states in each block of states
+        not connected to the rest by any transition
+        """
+        pairs = [(self.index(i), self.index(j)) for i, j, _ in self.dark + self.optical]
+        i, j = map(list, zip(*pairs)) if pairs else ([], [])
+
+        n_blocks, labels = connected_components(
+            sp.coo_matrix((np.ones(len(pairs)), (i, j)), shape=(len(self), len(self))), directed=False
+        )
+        return [np.flatnonzero(labels == block) for block in range(n_blocks)]
+
+    def check(self, rates, atol=1e-12):
+        """
+        Verify that the compiled generator and couplings conserve the population
+        and that all the transition rates are non-negative
+        """
+        matrices = [('G0', self.generator(rates, sparse=True))]
+        matrices += [('V[%s]' % name, v) for name, v in zip(self.spectra, self.couplings(sparse=True))]
+
+        for name, G in matrices:
+            if G.nnz == 0:
+                continue
+
+            if np.abs(G.sum(axis=0)).max() > atol * max(1., np.abs(G.data).max()):
+                raise ValueError("%s does not conserve the population" % name)
+
+            off_diagonal = G - sp.diags(G.diagonal())
+            if off_diagonal.nnz and off_diagonal.data.min() < 0:
+                raise ValueError("%s has negative transition rates" % name)
+
+    def kernels(self, rates):
+        """
+        Return the r.h.s. and the Jacobian of the rate equations
+
+                rhs(p, t, K, t0, width), jacobian(p, t, K, t0, width),
+
+        where K is the (number of pulses, len(self.spectra)) array of the optical rate constants
+        and t0, width are the arrays of the centers and the widths of the pulses.
+        """
+        self.check(rates)
+
+        G0 = self.generator(rates)
+        V = self.couplings()
+
+        def jacobian(p, t, K, t0, width):
+            """
+            Return the Jacobian of the rate equations, i.e., G(t)
+            """
+            intensity = np.exp(-((t - t0) / width) ** 2)
+            return G0 + np.tensordot(intensity.dot(K), V, axes=1)
+
+        def rhs(p, t, K, t0, width):
+            """
+            Return the r.h.s. of the rate equations
+            """
+            return jacobian(p, t, K, t0, width).dot(p)
+
+        return rhs, jacobian
+
+
+def unique(names):
+    """
+    Return the list of the unique names keeping their order
+    """
+    result = []
+    for name in names:
+        if name not in result:
+            result.append(name)
+    return result
+
+
+####################################################################################################
+#
+#   Models
+#
+####################################################################################################
+
+# One form (Pr or Pfr) of the phytochrome with the 5th state collecting the isomerized population
+# (the engine of Zak_kinetics_function)
+SINGLE_FORM = RateModel(
+    states=['1', '2', '3', '4', '5'],
+    dark=[
+        ('4', '1', 'A_41'),
+        ('2', '3', 'A_23'),
+        ('3', '4', 'A_34'),
+        ('3', '5', 'A_35'),
+    ],
+    optical=[
+        ('1', '2', 'abs'),
+        ('3', '4', 'ems'),
+    ],
+)
+
+# Full photocycle of KineticsProp: Pr (states 1-5) and Pfr (states 6-10)
+PHOTOCYCLE = RateModel(
+    states=['Pr', 'Pr*', '3', '4', '5', 'Pfr', 'Pfr*', '8', '9', '10'],
+    dark=[
+        ('4', 'Pr', 'A_41'),
+        ('10', 'Pr', 'A_101'),
+        ('Pr*', '3', 'A_23'),
+        ('3', '4', 'A_34'),
+        ('3', '5', 'A_35'),
+        ('5', 'Pfr', 'A_56'),
+        ('9', 'Pfr', 'A_96'),
+        ('Pfr*', '8', 'A_78'),
+        ('8', '9', 'A_89'),
+        ('8', '10', 'A_810'),
+    ],
+    optical=[
+        ('Pr', 'Pr*', 'Pr_abs'),
+        ('3', '4', 'Pr_ems'),
+        ('Pfr', 'Pfr*', 'Pfr_abs'),
+        ('8', '9', 'Pfr_ems'),
+    ],
+)
@@ -0,0 +1,191 @@
+"""
+Persistent, content-addressed cache of the values computed at the scan points.
+
+Each value is stored under the hash of the settings of the computation
+(kinetic_params, the content of the spectra file and the solver settings)
+together with the parameters of the point, so the same cache file can be shared by different scans:
+only the points never computed with identical settings have to be evaluated.
+
+The cache is an sqlite database; when it holds more than max_entries values
+the least recently used ones are evicted.
+"""
+import hashlib
+import sqlite3
+import numpy as np
+import spectra
+
+
+def canonical(value):
+    """
+    Return a description of the value that is the same in every run (unlike the repr of most objects,
+    which contains their address): numbers and strings by value, arrays by their content,
+    the objects with the method digest() (e.g., rate_model.RateModel) by it and the functions by their code
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes, type(u''))):
+        return repr(value)
+
+    if isinstance(value, np.generic):
+        return repr(value.item())
+
+    if isinstance(value, np.ndarray):
+        return 'array(%s, %s, %s)' % (
+            value.dtype.str, value.shape, hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()
+        )
+
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(sorted('%s: %s' % (canonical(k), canonical(v)) for k, v in value.items()))
+
+    if isinstance(value, (list, tuple)):
+        return '%s(%s)' % (type(value).__name__, ', '.join(canonical(v) for v in value))
+
+    if hasattr(value, 'digest'):
+        return '%s(%s)' % (type(value).__name__, value.digest())
+
+    if hasattr(value, '__code__'):
+        code = value.__code__
+        return 'function(%s.%s, %s)' % (
+            value.__module__, getattr(value, '__qualname__', value.__name__),
+            hashlib.sha1(code.co_code + repr(code.co_consts).encode('utf-8')).hexdigest()
+        )
+
+    raise ValueError("The parameter %r cannot be identified across runs" % (value,))
+
+
+def settings_digest(kinetic_params, spectra_file=spectra.SPECTRA_FILE, settings=None):
+    """
+    Return the hash identifying the computation
+    """
+    description = canonical((kinetic_params or {}, spectra.digest(spectra_file), settings or {}))
+    return hashlib.sha1(description.encode('utf-8')).digest()
+
+
+class ResultCache(object):
+    """
+    On-disk memo cache of func(point) for a fixed computation
+    """
+
+    # Maximal number of values kept in the cache file (None means unbounded)
+    max_entries = 10 ** 7
+
+    # Maximal number of keys in a single sql statement
+    query_size = 500
+
+    # Number of decimals the parameters of the points are rounded to before hashing
+    # (the same grid value computed by linspace or arange over another range may differ in the last bits)
+    decimals = 12
+
+    def __init__(self, path, kinetic_params, spectra_file=spectra.SPECTRA_FILE, settings=None, **kwargs):
+        """
+               path -- the cache file
+               kinetic_params -- parameters of the kinetics
+               spectra_file -- the file of the spectra (identified by its content)
+               settings -- dict of any other settings affecting the values (e.g., the engine used)
+
+         Optional:
+
+               max_entries -- maximal number of values kept in the cache file
+               decimals -- number of decimals of the parameters identifying a point
+        """
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+        self.path = path
+        self.digest = settings_digest(kinetic_params, spectra_file, settings)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, value REAL, used INTEGER)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self.connection.commit()
+
+        # counter of the accesses defining the order of the eviction
+        self.clock = self.connection.execute('SELECT COALESCE(MAX(used), 0) FROM results').fetchone()[0]
+
+        # number of the values in the cache file (kept up to date by insert and evict)
+        self.count = len(self)
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def keys(self, points):
+        """
+        Return the keys of the points (array of shape (N, number of parameters))
+        """
+        # (adding 0. turns -0. into 0.)
+        points = np.ascontiguousarray(np.round(np.atleast_2d(points).astype(np.float64), self.decimals) + 0.)
+        return [sqlite3.Binary(hashlib.sha1(self.digest + point.tobytes()).digest()) for point in points]
+
+    def lookup(self, points):
+        """
+        Return the cached values at the points (NaN for the points not in the cache)
+        """
+        keys = self.keys(points)
+        values = np.full(len(keys), np.nan)
+
+        position = dict((bytes(key), n) for n, key in enumerate(keys))
+        found = []
+
+        for start in range(0, len(keys), self.query_size):
+            chunk = keys[start:start + self.query_size]
+
+            for key, value in self.connection.execute(
+                'SELECT key, value FROM results WHERE key IN (%s)' % ','.join('?' * len(chunk)), chunk
+            ):
+                values[position[bytes(key)]] = value
+                found.append(key)
+
+        if found:
+            self.clock += 1
+            for start in range(0, len(found), self.query_size):
+                chunk = found[start:start + self.query_size]
+                self.connection.execute(
+                    'UPDATE results SET used = ? WHERE key IN (%s)' % ','.join('?' * len(chunk)),
+                    [self.clock] + chunk
+                )
+            self.connection.commit()
+
+        return values
+
+    def insert(self, points, values):
+        """
+        Store the values at the points (NaN values are not stored)
+        """
+        values = np.asarray(values, dtype=float)
+        stored = ~np.isnan(values)
+
+        if not stored.any():
+            return
+
+        self.clock += 1
+        rows = list(zip(values[stored].tolist(), [self.clock] * stored.sum(), self.keys(np.atleast_2d(points)[stored])))
+
+        # the values already in the cache are refreshed, the number of the new ones is that of the inserted rows
+        self.connection.executemany('UPDATE results SET value = ?, used = ? WHERE key = ?', rows)
+        changes = self.connection.total_changes
+        self.connection.executemany('INSERT OR IGNORE INTO results (value, used, key) VALUES (?, ?, ?)', rows)
+        self.count += self.connection.total_changes - changes
+
+        self.evict()
+        self.connection.commit()
+
+    def evict(self):
+        """
+        Remove the least recently used values beyond max_entries
+        """
+        if self.max_entries is None:
+            return
+
+        excess = self.count - self.max_entries
+
+        if excess > 0:
+            self.connection.execute(
+                'DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)', (excess,)
+            )
+            self.count -= excess
+
+    def close(self):
+        self.connection.close()
+
+    def __getstate__(self):
+        raise TypeError("ResultCache is used by the main process only")
@@ -0,0 +1,459 @@
+"""
+Checkpointed, resumable scans over regular parameter grids.
+
+The results are written into a memory-mapped array as the work units are completed,
+a completion bitmap of the same shape marks the finished grid points,
+so that a restarted scan evaluates only the remaining points.
+If a ResultCache is given, the points found in it are filled in before any work is dispatched
+and the computed values are added to it.
+
+Layout of the scan directory:
+
+        result.npy -- memory-mapped array of the results (NaN for the points not computed yet),
+                      of the shape of the grid followed by the number of outputs if the function returns several values
+        done.npy -- memory-mapped completion bitmap
+        meta.pickle -- names and values of the scan axes, kinetic_params and the accumulated wall time
+        stats/<name>.npy -- memory-mapped arrays of the solver counters and stage timings of each point
+                            (instrumented scans only, see instrumentation)
+"""
+import os
+import sys
+import pickle
+import timeit
+import threading
+from collections import OrderedDict
+from functools import partial
+import numpy as np
+import scan_store
+
+
+def evaluate_unit(func, axes, vectorized, indices, instrument=False):
+    """
+    Evaluate func at the grid points with the given flat indices.
+
+        func -- the function to scan (e.g., an instance of KineticsProp)
+        axes -- list of the values along each scan axis
+        vectorized -- whether func takes an (N, len(axes)) array of points at once
+        indices -- flat indices of the grid points
+        instrument -- whether to collect the stats of each point (func must take the dict stats, see instrumentation)
+
+    Return indices, the corresponding values, the id of the worker process, the time spent
+    and the dict of the arrays of the stats of the points (None if not instrumented).
+    """
+    start = timeit.default_timer()
+    shape = tuple(len(axis) for axis in axes)
+
+    points = np.column_stack([
+        np.asarray(axis)[i] for axis, i in zip(axes, np.unravel_index(indices, shape))
+    ])
+
+    stats = None
+
+    if vectorized:
+        if instrument:
+            stats = dict()
+            values = func(points, stats=stats)
+        else:
+            values = func(points)
+
+    elif instrument:
+        stats = dict()
+        values = []
+
+        for n, p in enumerate(points):
+            point_stats = dict()
+            values.append(func(tuple(p), stats=point_stats))
+
+            for name, value in point_stats.items():
+                stats.setdefault(name, np.zeros(len(points)))[n] = value
+    else:
+        values = [func(tuple(p)) for p in points]
+
+    return indices, np.asarray(values, dtype=float), os.getpid(), timeit.default_timer() - start, stats
+
+
+def bounded(iterable, semaphore):
+    """
+    Yield from iterable acquiring the semaphore before each item.
+
+    Pool.imap_unordered consumes its input eagerly in a separate thread,
+    this keeps at most as many work units in flight as the semaphore allows.
+    """
+    for item in iterable:
+        semaphore.acquire()
+        yield item
+
+
+def format_time(seconds):
+    """
+    Return the time interval as h:mm:ss
+    """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+class ScanRunner(object):
+    """
+    Resumable scan of a function over the Cartesian product of the parameter axes
+    """
+
+    # Number of grid points in a work unit
+    chunk_size = 1000
+
+    # Minimal time in seconds between flushing the results to the disk
+    checkpoint_interval = 30.
+
+    # Maximal number of work units dispatched to the pool but not completed yet
+    max_pending = 64
+
+    # Time in seconds between the progress reports (None means no reports)
+    report_interval = 10.
+
+    # Axes varied fastest within the work units, so that the points of a work unit come in blocks
+    # sharing the values along all the other axes (e.g., the pulse energies for KineticsProp.sweep)
+    sweep_axes = ()
+
+    # ResultCache consulted before dispatching the work units (None means no cache)
+    cache = None
+
+    # Whether the solver counters and the stage timings of each point are collected
+    # (the function must take the dict stats, see instrumentation)
+    instrument = False
+
+    # Names of the values returned by the function for each point (None means a single value),
+    # e.g., the outputs of uncertainty.RateUncertainty
+    outputs = None
+
+    def __init__(self, path, params, kinetic_params=None, **kwargs):
+        """
+               path -- directory of the scan
+               params -- ordered dict of the scan axes {name: values}
+               kinetic_params -- parameters of the kinetics stored alongside the results
+
+         Optional:
+
+               chunk_size -- number of grid points in a work unit
+               checkpoint_interval -- minimal time in seconds between flushing the results
+               max_pending -- maximal number of work units in flight
+               report_interval -- time in seconds between the progress reports
+               sweep_axes -- axes varied fastest within the work units
+               cache -- ResultCache of the previously computed points
+               outputs -- names of the values returned for each point
+               instrument -- whether to collect the solver counters and the stage timings of each point
+        """
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+        self.path = path
+        self.params = OrderedDict((name, np.asarray(values)) for name, values in params.items())
+        self.kinetic_params = kinetic_params
+        self.shape = tuple(len(values) for values in self.params.values())
+
+        if self.outputs is not None and self.cache is not None:
+            raise ValueError("The result cache holds single values only, it cannot be used with outputs")
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # arrays of the stats of each point opened as they appear
+        self.stats = dict()
+
+        if os.path.exists(self.meta_file):
+            self._resume()
+        else:
+            self._create()
+
+    @property
+    def meta_file(self):
+        return os.path.join(self.path, 'meta.pickle')
+
+    def _create(self):
+        """
+        Preallocate the result array and the completion bitmap
+        """
+        self.time = 0.
+
+        self.result = np.lib.format.open_memmap(
+            os.path.join(self.path, 'result.npy'), mode='w+', dtype=float,
+            shape=self.shape if self.outputs is None else self.shape + (len(self.outputs),)
+        )
+        self.result[...] = np.nan
+
+        self.done = np.lib.format.open_memmap(
+            os.path.join(self.path, 'done.npy'), mode='w+', dtype=bool, shape=self.shape
+        )
+
+        self.flush()
+
+    def _resume(self):
+        """
+        Open the arrays of an interrupted scan making sure that it is the same scan
+        """
+        with open(self.meta_file, 'rb') as file_in:
+            meta = pickle.load(file_in)
+
+        same_params = list(meta['params']) == list(self.params) and all(
+            np.array_equal(meta['params'][name], values) for name, values in self.params.items()
+        )
+
+        if not same_params or meta['kinetic_params'] != self.kinetic_params \
+                or meta.get('outputs') != self.outputs:
+            raise ValueError(
+                "Directory '%s' contains a different scan (params, kinetic_params or outputs do not match)"
+                % self.path
+            )
+
+        self.time = meta['time']
+        self.result = np.load(os.path.join(self.path, 'result.npy'), mmap_mode='r+')
+        self.done = np.load(os.path.join(self.path, 'done.npy'), mmap_mode='r+')
+
+        for name in meta.get('stats', []):
+            self.stats[name] = np.load(os.path.join(self.path, 'stats', name + '.npy'), mmap_mode='r+')
+
+    def stats_array(self, name):
+        """
+        Return the array of the stats name of each point (created filled with NaN and recorded in the metadata
+        at once, so a resumed scan reopens it instead of overwriting it)
+        """
+        if name not in self.stats:
+            filename = os.path.join(self.path, 'stats', name + '.npy')
+
+            if os.path.exists(filename):
+                array = np.load(filename, mmap_mode='r+')
+
+                if array.shape == self.shape:
+                    self.stats[name] = array
+                    return array
+
+            if not os.path.isdir(os.path.join(self.path, 'stats')):
+                os.makedirs(os.path.join(self.path, 'stats'))
+
+            self.stats[name] = np.lib.format.open_memmap(filename, mode='w+', dtype=float, shape=self.shape)
+            self.stats[name][...] = np.nan
+            self.flush()
+
+        return self.stats[name]
+
+    def flush(self):
+        """
+        Save the results and the completion bitmap (in that order) followed by the metadata
+        (replaced atomically, so an interrupted flush leaves the previous metadata)
+        """
+        self.result.flush()
+        self.done.flush()
+
+        for array in self.stats.values():
+            array.flush()
+
+        temporary = '%s.%d.tmp' % (self.meta_file, os.getpid())
+
+        with open(temporary, 'wb') as file_out:
+            pickle.dump(
+                {
+                    'kinetic_params': self.kinetic_params,
+                    'params': self.params,
+                    'outputs': self.outputs,
+                    'stats': sorted(self.stats),
+                    'time': self.time,
+                },
+                file_out
+            )
+
+        os.replace(temporary, self.meta_file)
+
+    def remaining(self):
+        """
+        Return the number of grid points not computed yet
+        """
+        return self.done.size - np.count_nonzero(self.done)
+
+    def points(self, indices):
+        """
+        Return the parameters of the grid points with the given flat indices
+        """
+        return np.column_stack([
+            values[i] for values, i in zip(self.params.values(), np.unravel_index(indices, self.shape))
+        ])
+
+    def load_cached(self):
+        """
+        Fill in the unfinished grid points found in the cache and return their number
+        """
+        result = self.result.reshape(-1)
+        done = self.done.reshape(-1)
+
+        found = 0
+
+        for indices in self.work_units():
+            values = self.cache.lookup(self.points(indices))
+            cached = ~np.isnan(values)
+
+            result[indices[cached]] = values[cached]
+            done[indices[cached]] = True
+
+            found += np.count_nonzero(cached)
+
+        if found:
+            self.flush()
+
+        return found
+
+    def work_units(self):
+        """
+        Yield the flat indices of the unfinished grid points about chunk_size at a time
+        (whole blocks of the grid along sweep_axes)
+        """
+        done = self.done.reshape(-1)
+
+        # the grid is traversed with the sweep axes being the fastest
+        order = [axis for axis in range(len(self.shape)) if axis not in self.sweep_axes] + list(self.sweep_axes)
+        traversed_shape = [self.shape[axis] for axis in order]
+
+        block = int(np.prod([self.shape[axis] for axis in self.sweep_axes]))
+        chunk_size = max(1, self.chunk_size // block) * block
+
+        for start in range(0, done.size, chunk_size):
+            traversed = np.unravel_index(np.arange(start, min(start + chunk_size, done.size)), traversed_shape)
+
+            multi_index = [None] * len(order)
+            for axis, index in zip(order, traversed):
+                multi_index[axis] = index
+
+            indices = np.ravel_multi_index(multi_index, self.shape)
+            indices = indices[~done[indices]]
+
+            if indices.size:
+                yield indices
+
+    def run(self, func, pool=None, vectorized=False):
+        """
+        Evaluate func at all the unfinished grid points and return the result array.
+
+               func -- the function to scan (must be picklable if pool is given)
+               pool -- multiprocessing pool (if None, the scan runs in the current process)
+               vectorized -- whether func takes an (N, len(params)) array of points at once
+
+        The work units are generated lazily and scattered into the result array as they complete,
+        so the memory footprint does not depend on the size of the grid.
+        The points found in the cache are not dispatched.
+        """
+        if self.cache is not None:
+            self.load_cached()
+
+        evaluate = partial(
+            evaluate_unit, func, list(self.params.values()), vectorized, instrument=self.instrument
+        )
+
+        if pool is not None:
+            pending = threading.BoundedSemaphore(self.max_pending)
+            completed = pool.imap_unordered(evaluate, bounded(self.work_units(), pending))
+        else:
+            pending = None
+            completed = map(evaluate, self.work_units())
+
+        result = self.result.reshape((self.done.size, -1) if self.outputs is not None else -1)
+        done = self.done.reshape(-1)
+
+        self.progress = {
+            'start': timeit.default_timer(),
+            'remaining': self.remaining(),
+            'points': 0,
+            'busy': dict(),
+        }
+
+        start = last_checkpoint = last_report = self.progress['start']
+
+        for indices, values, worker, busy, stats in completed:
+            if pending is not None:
+                pending.release()
+
+            for name, value in (stats or {}).items():
+                self.stats_array(name).reshape(-1)[indices] = value
+
+            result[indices] = values
+            done[indices] = True
+
+            if self.cache is not None:
+                self.cache.insert(self.points(indices), values)
+
+            self.progress['points'] += indices.size
+            self.progress['busy'][worker] = self.progress['busy'].get(worker, 0.) + busy
+
+            now = timeit.default_timer()
+
+            if now - last_checkpoint > self.checkpoint_interval:
+                self.time += now - start
+                start = last_checkpoint = now
+                self.flush()
+
+            if self.report_interval is not None and now - last_report > self.report_interval:
+                last_report = now
+                self.report()
+
+        self.time += timeit.default_timer() - start
+        self.flush()
+
+        if self.report_interval is not None:
+            self.report()
+
+        return self.result
+
+    def report(self, out=sys.stdout):
+        """
+        Print the progress of the running scan: throughput, ETA and utilization of each worker
+        """
+        progress = self.progress
+        elapsed = timeit.default_timer() - progress['start']
+
+        rate = progress['points'] / elapsed if elapsed > 0 else 0.
+        left = progress['remaining'] - progress['points']
+
+        out.write(
+            '%d/%d points (%.1f%%), %.1f points/s, elapsed %s, ETA %s\n' % (
+                progress['points'], progress['remaining'],
+                100. * progress['points'] / max(progress['remaining'], 1),
+                rate, format_time(elapsed), format_time(left / rate) if rate > 0 else '?'
+            )
+        )
+
+        # fraction of the wall time each worker spent evaluating (low values mean starved workers)
+        if elapsed > 0 and progress['busy']:
+            out.write('    worker utilization: %s\n' % ', '.join(
+                '%d: %.0f%%' % (worker, 100. * busy / elapsed) for worker, busy in sorted(progress['busy'].items())
+            ))
+
+        out.flush()
+
+    def export(self, filename):
+        """
+        Save the scan in the format of result.pickle
+        """
+        with open(filename, 'wb') as file_out:
+            pickle.dump(
+                {
+                    'kinetic_params': self.kinetic_params,
+                    'params': dict(self.params),
+                    'result': np.array(self.result),
+                    'outputs': self.outputs,
+                    'stats': dict((name, np.array(array)) for name, array in self.stats.items()),
+                    'time': self.time
+                },
+                file_out
+            )
+
+    def save(self, path, **kwargs):
+        """
+        Save the scan into a chunked store (kwargs as for scan_store.save, e.g., dtype and compress),
+        the scans with several outputs are saved into a store for each output in path/<output name>
+        """
+        if self.outputs is not None:
+            return [
+                scan_store.save(
+                    os.path.join(path, name), self.result[..., n], self.params, self.kinetic_params, self.time,
+                    **kwargs
+                )
+                for n, name in enumerate(self.outputs)
+            ]
+
+        return scan_store.save(path, self.result, self.params, self.kinetic_params, self.time, **kwargs)
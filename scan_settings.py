@@ -0,0 +1,56 @@
+"""
+Settings shared by the 6D scripts (6D_scan.py, 6D_adaptive_scan.py, 6D_optimize.py, 6D_uncertainty.py):
+the parameters of the kinetics and the ranges of the scan axes.
+"""
+from collections import OrderedDict
+import numpy as np
+from scan_store import AXES_NAMES
+
+# Parameters of KineticsProp
+KINETIC_PARAMS = dict(
+    # Pulses characterization
+    pump_central=625.,
+    pump_bw=40.,
+
+    dump_central=835.,
+    dump_bw=10.,
+
+    beam_diameter=200.,
+
+    T_max=100.0,
+    T_steps=1000,
+    pulse_tol=1e-10,
+    propagator='matrix',
+    batch_size=1000,
+
+    A_41=1 / .150,
+    A_23=1 / .150,
+    A_35=1 / 68.5,
+    A_34=2.5 / 68.5,
+    A_56=1 / 0.1,
+
+    A_96=1 / .050,
+    A_78=1 / .050,
+    A_810=1 / 2.5,
+    A_89=2.0,
+    A_101=1 / 0.1,
+
+    Iterations=51,
+)
+
+# (min, max) of each scan axis
+SCAN_RANGES = OrderedDict(zip(AXES_NAMES, [
+    (0.1, 0.4),         # pump_energy
+    (1.0, 3.0),         # dump_energy
+    (.050, .150),       # pump_width
+    (.100, .200),       # dump_width
+    (0.25, 0.75),       # t0_pump
+    (0.30, 0.80),       # t0_dump
+]))
+
+
+def grid(n_points):
+    """
+    Return the axes {name: values} of the grid of n_points points along each axis spanning SCAN_RANGES
+    """
+    return OrderedDict((name, np.linspace(low, high, n_points)) for name, (low, high) in SCAN_RANGES.items())
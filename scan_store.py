@@ -0,0 +1,273 @@
+"""
+Chunked on-disk storage of scan results that can be opened and sliced lazily.
+
+Layout of the store directory:
+
+        meta.pickle -- names and values of the scan axes, kinetic_params, the wall time of the scan,
+                       the shape of the grid and of the chunks, the dtype and whether the chunks are compressed
+        chunk_<i>_<j>_..._<n>.npy -- the block of the result array with the chunk indices i, j, ..., n
+                                     (.npz if compressed)
+
+Opening a store reads only the metadata; indexing it reads only the chunks intersecting the selection.
+"""
+import os
+import pickle
+import warnings
+from collections import OrderedDict
+from itertools import product
+import numpy as np
+
+# Default number of grid points in a chunk (1 MB of float64)
+CHUNK_POINTS = 2 ** 17
+
+# Names of the axes of the 6D scans in the order of the grid
+AXES_NAMES = ('pump_energy', 'dump_energy', 'pump_width', 'dump_width', 't0_pump', 't0_dump')
+
+# Range of the physically meaningful values
+VALID_RANGE = (0., 1.)
+
+
+def chunk_shape(shape, chunk_points=CHUNK_POINTS):
+    """
+    Return the shape of the chunks of about chunk_points points obtained by halving the longest axes
+    """
+    chunks = list(shape)
+
+    while np.prod(chunks) > chunk_points and max(chunks) > 1:
+        axis = int(np.argmax(chunks))
+        chunks[axis] = (chunks[axis] + 1) // 2
+
+    return tuple(chunks)
+
+
+def save(path, result, params, kinetic_params=None, time=0., dtype=float, compress=False, chunks=None):
+    """
+    Save the result array (e.g., a memory-mapped array of ScanRunner) into the store directory path.
+
+           result -- array of the results over the grid
+           params -- ordered dict of the scan axes {name: values}
+           kinetic_params -- parameters of the kinetics
+           time -- wall time of the scan
+           dtype -- dtype of the stored values (e.g., np.float32 halves the size)
+           compress -- whether the chunks are compressed
+           chunks -- shape of the chunks (None means about CHUNK_POINTS points)
+    """
+    shape = tuple(len(values) for values in params.values())
+
+    if result.shape != shape:
+        raise ValueError("The shape %s of the result does not match the axes %s" % (result.shape, shape))
+
+    chunks = tuple(chunks or chunk_shape(shape))
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    store = ScanStore.__new__(ScanStore)
+    store.path = path
+    store.shape = shape
+    store.chunks = chunks
+    store.compress = compress
+
+    for index in product(*[range(-(-n // c)) for n, c in zip(shape, chunks)]):
+        block = np.ascontiguousarray(result[store.chunk_slices(index)], dtype=dtype)
+
+        if compress:
+            np.savez_compressed(store.chunk_file(index), block=block)
+        else:
+            np.save(store.chunk_file(index), block)
+
+    # the metadata are written last, a store without them is incomplete
+    with open(os.path.join(path, 'meta.pickle'), 'wb') as file_out:
+        pickle.dump(
+            {
+                'params': OrderedDict((name, np.asarray(values)) for name, values in params.items()),
+                'kinetic_params': kinetic_params,
+                'time': time,
+                'shape': shape,
+                'chunks': chunks,
+                'dtype': np.dtype(dtype).str,
+                'compress': compress,
+            },
+            file_out
+        )
+
+    return ScanStore(path)
+
+
+class ScanStore(object):
+    """
+    Lazily loaded scan results (indexed as the result array)
+    """
+
+    def __init__(self, path):
+        """
+               path -- the store directory
+        """
+        self.path = path
+
+        with open(os.path.join(path, 'meta.pickle'), 'rb') as file_in:
+            meta = pickle.load(file_in)
+
+        self.params = meta['params']
+        self.kinetic_params = meta['kinetic_params']
+        self.time = meta['time']
+        self.shape = meta['shape']
+        self.chunks = meta['chunks']
+        self.dtype = np.dtype(meta['dtype'])
+        self.compress = meta['compress']
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def chunk_file(self, index):
+        return os.path.join(
+            self.path, 'chunk_%s.%s' % ('_'.join(map(str, index)), 'npz' if self.compress else 'npy')
+        )
+
+    def chunk_slices(self, index):
+        """
+        Return the slices of the grid covered by the chunk with the given chunk indices
+        """
+        return tuple(slice(i * c, min((i + 1) * c, n)) for i, c, n in zip(index, self.chunks, self.shape))
+
+    def read_chunk(self, index):
+        """
+        Return the block of the results of the chunk with the given chunk indices
+        """
+        if self.compress:
+            with np.load(self.chunk_file(index)) as data:
+                return data['block']
+
+        return np.load(self.chunk_file(index))
+
+    def iter_chunks(self):
+        """
+        Yield the slices of the grid and the blocks of the results of all the chunks
+        (the whole scan is streamed with the memory of a single chunk)
+        """
+        for index in product(*[range(-(-n // c)) for n, c in zip(self.shape, self.chunks)]):
+            yield self.chunk_slices(index), self.read_chunk(index)
+
+    def __getitem__(self, key):
+        """
+        Return the results of the selection made of integers and slices (reading only the chunks needed)
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        if Ellipsis in key:
+            position = key.index(Ellipsis)
+            key = key[:position] + (slice(None),) * (self.ndim - len(key) + 1) + key[position + 1:]
+
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        # selected indices along each axis
+        selected = []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, slice):
+                selected.append(np.arange(n)[k])
+            else:
+                selected.append(np.array([np.arange(n)[k]]))
+
+        result = np.empty(tuple(len(s) for s in selected), dtype=self.dtype)
+
+        # chunks intersecting the selection
+        chunk_indices = [np.unique(s // c) for s, c in zip(selected, self.chunks)]
+
+        for index in product(*chunk_indices):
+            block = self.read_chunk(index)
+
+            target, source = [], []
+            for s, i, c in zip(selected, index, self.chunks):
+                inside = np.flatnonzero(s // c == i)
+                target.append(inside)
+                source.append(s[inside] - i * c)
+
+            result[np.ix_(*target)] = block[np.ix_(*source)]
+
+        # the axes indexed by integers are dropped
+        return result.reshape([len(s) for k, s in zip(key, selected) if isinstance(k, slice)])
+
+    def index(self, **point):
+        """
+        Return the selection of the grid points closest to the given values of some axes, e.g.,
+
+                store[store.index(t0_pump=0.5, t0_dump=0.55)]
+        """
+        for name in point:
+            if name not in self.params:
+                raise ValueError("Unknown axis '%s'" % name)
+
+        return tuple(
+            int(np.argmin(np.abs(values - point[name]))) if name in point else slice(None)
+            for name, values in self.params.items()
+        )
+
+    def project(self, axes, reduce=np.nanmax):
+        """
+        Return the projection of the results onto the given axes, reduced over all the other axes
+        by np.nanmax, np.nanmin or np.nanmean (streamed chunk by chunk)
+        """
+        axes = tuple(sorted(axes))
+        other = tuple(axis for axis in range(self.ndim) if axis not in axes)
+
+        if reduce is np.nanmean:
+            total = np.zeros([self.shape[axis] for axis in axes])
+            count = np.zeros_like(total)
+        else:
+            total = np.full([self.shape[axis] for axis in axes], np.nan)
+
+        # the reductions over all-NaN slices warn and return NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+
+            for slices, block in self.iter_chunks():
+                target = tuple(slices[axis] for axis in axes)
+
+                if reduce is np.nanmean:
+                    total[target] += np.nansum(block, axis=other)
+                    count[target] += np.sum(~np.isnan(block), axis=other)
+                else:
+                    total[target] = reduce(np.stack([total[target], reduce(block, axis=other)]), axis=0)
+
+            if reduce is np.nanmean:
+                return total / count
+
+        return total
+
+    def to_pickle(self, filename):
+        """
+        Save the scan in the format of result.pickle
+        """
+        with open(filename, 'wb') as file_out:
+            pickle.dump(
+                {
+                    'kinetic_params': self.kinetic_params,
+                    'params': dict(self.params),
+                    'result': self[...],
+                    'time': self.time
+                },
+                file_out
+            )
+
+
+def from_pickle(filename, path, **kwargs):
+    """
+    Convert the result.pickle file into the store directory path (kwargs as for save)
+    """
+    with open(filename, 'rb') as file_in:
+        data = pickle.load(file_in)
+
+    params = data['params']
+
+    if not isinstance(params, OrderedDict):
+        params = OrderedDict((name, params[name]) for name in AXES_NAMES)
+
+    return save(
+        path, np.asarray(data['result']), params, data.get('kinetic_params'), data.get('time', 0.), **kwargs
+    )
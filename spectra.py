@@ -0,0 +1,124 @@
+"""
+Shared store of the absorption and emission spectra of the Pr and Pfr states.
+
+The csv file is parsed only once per process, a binary copy is kept next to it
+(refreshed whenever the modification time or the size of the csv file changes),
+and the loaded spectra can be handed to the pool workers by install().
+"""
+import os
+import hashlib
+from collections import namedtuple
+import numpy as np
+
+# The reference spectra shipped with the code
+SPECTRA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Cph8_RefSpectra.csv")
+
+# Peak values of the scaled spectra
+PR_PEAK = 60000.
+PFR_PEAK = 50000.
+
+Spectra = namedtuple('Spectra', ['lamb', 'Pr_abs', 'Pfr_abs', 'Pr_ems', 'Pfr_ems', 'data'])
+
+# Loaded spectra for each file
+_store = dict()
+
+# Content hashes for each (file, modification time, size)
+_digests = dict()
+
+
+def cache_file(filename):
+    """
+    Return the name of the binary copy of the csv file
+    """
+    return os.path.splitext(filename)[0] + '_cache.npz'
+
+
+def read(filename=SPECTRA_FILE):
+    """
+    Return the raw content of the csv file using its binary copy whenever it is up to date
+    """
+    stat = os.stat(filename)
+    cache = cache_file(filename)
+
+    try:
+        with np.load(cache) as cached:
+            if cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+                return cached['data']
+    except Exception:
+        # missing or damaged (e.g., truncated) binary copy, it is rewritten from the csv file
+        pass
+
+    data = np.loadtxt(filename, delimiter=',')
+
+    # the binary copy appears complete or not at all
+    temporary = '%s.%d.tmp' % (cache, os.getpid())
+
+    try:
+        with open(temporary, 'wb') as file_out:
+            np.savez(file_out, data=data, mtime=stat.st_mtime, size=stat.st_size)
+        os.replace(temporary, cache)
+    except (IOError, OSError):
+        # read only location, the binary copy is an optimization only
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+    return data
+
+
+def load(filename=SPECTRA_FILE):
+    """
+    Return the scaled spectra (read only arrays shared by all the callers)
+    """
+    filename = os.path.abspath(filename)
+
+    try:
+        return _store[filename]
+    except KeyError:
+        pass
+
+    data = read(filename)
+
+    # ===========================================================================#
+    # -------GET ABSORPTION EMISSION DATA OF PR AND PFR STATES BY SCALING--------#
+    # ===========================================================================#
+    spectra = Spectra(
+        lamb=data[:, 0],
+        Pr_abs=data[:, 1] * (PR_PEAK / data[:, 1].max()),
+        Pfr_abs=data[:, 2] * (PFR_PEAK / data[:, 2].max()),
+        Pr_ems=data[:, 3] * (PR_PEAK / data[:, 3].max()),
+        Pfr_ems=data[:, 4] * (PFR_PEAK / data[:, 4].max()),
+        data=data,
+    )
+
+    return install(spectra, filename)
+
+
+def install(spectra, filename=SPECTRA_FILE):
+    """
+    Put the loaded spectra into the store (to be used as the initializer of the pool workers)
+    """
+    for array in spectra:
+        array.setflags(write=False)
+
+    _store[os.path.abspath(filename)] = spectra
+    return spectra
+
+
+def digest(filename=SPECTRA_FILE):
+    """
+    Return the SHA-1 hash of the content of the csv file
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+    try:
+        return _digests[key]
+    except KeyError:
+        pass
+
+    with open(filename, 'rb') as file_in:
+        _digests[key] = hashlib.sha1(file_in.read()).hexdigest()
+
+    return _digests[key]
@@ -0,0 +1,53 @@
+"""
+Stationary population of the transfer matrix (M v = v, sum(v) = 1)
+"""
+import numpy as np
+
+
+def steady_state(M, return_residual=False):
+    """
+    Return the stationary population of the column stochastic transfer matrix M.
+
+    M can be a stack of matrices (..., n, n), then the populations (..., n) are returned.
+    Since the columns of M - 1 sum to zero, one of the equations (M - 1) v = 0 is redundant
+    and it is replaced by the normalization sum(v) = 1; the resulting linear system is solved directly.
+    If it is singular (e.g., the steady state is not unique), the eigenvector of M with the eigenvalue
+    closest to 1 is taken instead.
+
+    If return_residual is True, the residual max|M v - v| is returned as well.
+    """
+    M = np.asarray(M, dtype=float)
+    n = M.shape[-1]
+
+    A = M - np.eye(n)
+    A[..., -1, :] = 1.
+
+    b = np.zeros(M.shape[:-1] + (1,))
+    b[..., -1, 0] = 1.
+
+    try:
+        v = np.linalg.solve(A, b)[..., 0]
+    except np.linalg.LinAlgError:
+        v = np.empty(M.shape[:-1])
+
+        for index in np.ndindex(*M.shape[:-2]):
+            try:
+                v[index] = np.linalg.solve(A[index], b[index])[:, 0]
+            except np.linalg.LinAlgError:
+                v[index] = eigenvector(M[index])
+
+    if return_residual:
+        residual = np.abs(np.matmul(M, v[..., np.newaxis])[..., 0] - v).max(axis=-1)
+        return v, residual
+
+    return v
+
+
+def eigenvector(M):
+    """
+    Return the normalized eigenvector of the matrix M with the eigenvalue closest to 1
+    """
+    vals, vecs = np.linalg.eig(M)
+
+    v = vecs[:, np.abs(vals - 1).argmin()].real
+    return v / v.sum()
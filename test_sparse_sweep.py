@@ -0,0 +1,27 @@
+"""
+The sweep and batch paths of KineticsProp with a model compiled to sparse matrices
+"""
+import numpy as np
+from kinetics_prop import KineticsProp
+from benchmark import EXAMPLE_PARAMS, EXAMPLE_POINT
+
+POINTS = np.array([
+    EXAMPLE_POINT,
+    (0.30, 2.0, .100, .150, 0.5, 0.5251),
+    (0.25, 2.5, .100, .150, 0.5, 0.5251),
+    (0.25, 2.0, .120, .150, 0.5, 0.5251),
+])
+
+
+def test_sparse_sweep_matches_dense():
+    sparse = KineticsProp(**dict(EXAMPLE_PARAMS, sparse_threshold=0))
+    dense = KineticsProp(**dict(EXAMPLE_PARAMS, propagator='matrix'))
+    assert sparse.sparse and not dense.sparse
+
+    stats = dict()
+    population = sparse.sweep(POINTS, stats=stats)
+
+    assert population.shape == (len(POINTS),)
+    assert stats['nmv'].shape == (len(POINTS),)
+    assert np.allclose(population, [dense(point) for point in POINTS], atol=1e-6)
+    assert np.allclose(population, sparse.batch(POINTS), atol=1e-6)
@@ -1,51 +1,21 @@
-import matplotlib.pyplot as plt
-import numpy as np
+from multiprocessing import Pool
 import pickle
-import itertools
 
-from matplotlib.colors import Normalize
+from projections import project_all, render
+from scan_store import AXES_NAMES
 
-# Load the data
-with open("Data/result_9points.pickle", 'rb') as f:
-    data = pickle.load(f)
-    scan = data['result']
+if __name__ == '__main__':
 
-# find the position of maximum pop
-indx = np.unravel_index(scan.argmax(), scan.shape)
+    # Load the data
+    with open("Data/result_9points.pickle", 'rb') as f:
+        data = pickle.load(f)
+        scan = data['result']
 
+    # all the 15 maps in a single pass over the scan (the values not in [0, 1] are ignored);
+    # scan may also be a scan_store.ScanStore or a memory-mapped array
+    projections = project_all(scan)
 
-axes_names = ['pump_energy', 'dump_energy', 'pump_width', 'dump_width', 't0_pump', 't0_dump']
+    # find the position of maximum pop
+    indx = projections.best()
 
-
-#np.clip(scan, 0, 1, out=scan)
-scan[(scan > 1)|(scan < 0.)] = np.nan
-
-for axis in itertools.combinations(range(6), 4):
-    plot_axis = tuple(sorted(
-        set(range(6)).difference(axis)
-    ))
-
-    xlabel = axes_names[plot_axis[0]]
-    ylabel = axes_names[plot_axis[1]]
-
-    x_min = data['params'][xlabel].min()
-    x_max = data['params'][xlabel].max()
-    y_min = data['params'][ylabel].min()
-    y_max = data['params'][ylabel].max()
-
-    plt.clf()
-    plt.imshow(
-        np.nanmax(scan, axis=axis),
-        origin='lower',
-        interpolation='nearest',
-        extent=[x_min, x_max, y_min, y_max],
-        aspect=(x_max - x_min)/(y_max - y_min),
-        vmin=np.nanmin(scan),
-        vmax=np.nanmax(scan)
-    )
-
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-
-    plt.colorbar()
-    plt.savefig('Plots/scan_%d_%d.png' % plot_axis)
\ No newline at end of file
+    render(projections, data['params'], AXES_NAMES, 'Plots', 'maximum', pool=Pool(4))
@@ -0,0 +1,268 @@
+"""
+Work queue on a shared filesystem distributing the work units of a scan over many machines.
+
+FileQueue replaces the multiprocessing pool of ScanRunner.run (it provides imap_unordered),
+the coordinator writes each work unit (the pickled function and its argument) into the queue directory
+and the workers started on any machine seeing the directory pull the units, evaluate them
+and write back the results:
+
+        pending/<unit> -- units waiting for a worker
+        claimed/<unit> -- units being evaluated (the file is touched by the worker as a lease)
+        results/<unit> -- pickled results (or the exceptions raised) of the evaluated units
+        stop -- asks the workers to exit
+
+A unit is claimed by renaming it from pending/ into claimed/ (atomic, so each unit goes to a single worker).
+The units whose lease has not been renewed for lease_time seconds (the worker died or lost the filesystem)
+are moved back into pending/ by the coordinator, and the results of the units evaluated twice are used once.
+
+Workers are started by
+
+        python work_queue.py <queue directory> [<lease_time of the coordinator>]
+
+(local_workers() starts them as local processes, e.g., for tests).
+"""
+import os
+import sys
+import time
+import pickle
+import threading
+from multiprocessing import Process
+
+
+def write_atomic(filename, obj):
+    """
+    Pickle obj into filename so that the file appears complete or not at all
+    """
+    temporary = '%s.%d.tmp' % (filename, os.getpid())
+
+    with open(temporary, 'wb') as file_out:
+        pickle.dump(obj, file_out, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.rename(temporary, filename)
+
+
+class FileQueue(object):
+    """
+    Coordinator of the workers sharing the queue directory (drop-in for multiprocessing.Pool in ScanRunner.run)
+    """
+
+    # Time in seconds after which a unit whose lease was not renewed is given to another worker
+    lease_time = 60.
+
+    # Time in seconds between the checks of the queue directory
+    poll_interval = 0.1
+
+    def __init__(self, path, **kwargs):
+        """
+               path -- the queue directory on the filesystem shared with the workers
+
+         Optional:
+
+               lease_time -- time in seconds after which an unfinished unit is handed out again
+               poll_interval -- time in seconds between the checks of the queue directory
+        """
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+        self.path = path
+
+        # the units left by an interrupted coordinator are dropped (ScanRunner resumes from its own storage)
+        for directory in ('pending', 'claimed', 'results'):
+            if not os.path.isdir(os.path.join(path, directory)):
+                os.makedirs(os.path.join(path, directory))
+
+            for unit in os.listdir(os.path.join(path, directory)):
+                os.remove(os.path.join(path, directory, unit))
+
+        if os.path.exists(os.path.join(path, 'stop')):
+            os.remove(os.path.join(path, 'stop'))
+
+        self.count = 0
+
+    def requeue_expired(self):
+        """
+        Move the units with expired leases back into pending/ and return their number
+        """
+        requeued = 0
+        now = time.time()
+
+        for unit in os.listdir(os.path.join(self.path, 'claimed')):
+            claimed = os.path.join(self.path, 'claimed', unit)
+
+            try:
+                if now - os.path.getmtime(claimed) > self.lease_time:
+                    os.rename(claimed, os.path.join(self.path, 'pending', unit))
+                    requeued += 1
+            except OSError:
+                # the unit has just been finished
+                pass
+
+        return requeued
+
+    def imap_unordered(self, func, iterable):
+        """
+        Yield func(item) for the items of iterable in the order of completion
+        """
+        submitted = set()
+        collected = set()
+        feeding = {'done': False, 'error': None}
+
+        def feed():
+            try:
+                for item in iterable:
+                    unit = '%010d' % self.count
+                    self.count += 1
+
+                    submitted.add(unit)
+                    write_atomic(os.path.join(self.path, 'pending', unit), (func, item))
+            except Exception as error:
+                feeding['error'] = error
+            finally:
+                feeding['done'] = True
+
+        # the items are consumed in a separate thread as by multiprocessing.Pool
+        # (the iterable may block until the results are collected)
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+
+        last_requeue = time.time()
+
+        while True:
+            finished = feeding['done']
+            results = sorted(
+                unit for unit in os.listdir(os.path.join(self.path, 'results')) if not unit.endswith('.tmp')
+            )
+
+            for unit in results:
+                filename = os.path.join(self.path, 'results', unit)
+
+                with open(filename, 'rb') as file_in:
+                    success, value = pickle.load(file_in)
+                os.remove(filename)
+
+                if unit not in submitted or unit in collected:
+                    continue
+
+                collected.add(unit)
+
+                if not success:
+                    raise value
+
+                yield value
+
+            if feeding['error'] is not None:
+                raise feeding['error']
+
+            if finished and collected == submitted:
+                return
+
+            if time.time() - last_requeue > self.poll_interval * 10:
+                self.requeue_expired()
+                last_requeue = time.time()
+
+            if not results:
+                time.sleep(self.poll_interval)
+
+    def close(self):
+        """
+        Ask the workers to exit
+        """
+        open(os.path.join(self.path, 'stop'), 'w').close()
+
+    def terminate(self):
+        self.close()
+
+
+def claim(path):
+    """
+    Claim a pending unit and return its name (None if there is none)
+    """
+    for unit in sorted(os.listdir(os.path.join(path, 'pending'))):
+        if unit.endswith('.tmp'):
+            continue
+
+        try:
+            os.rename(os.path.join(path, 'pending', unit), os.path.join(path, 'claimed', unit))
+        except OSError:
+            # claimed by another worker
+            continue
+
+        # the lease starts now, not at the submission
+        os.utime(os.path.join(path, 'claimed', unit), None)
+        return unit
+
+
+def worker(path, poll_interval=0.1, lease_time=FileQueue.lease_time):
+    """
+    Evaluate the units of the queue in the directory path until the stop file appears
+    """
+    while not os.path.exists(os.path.join(path, 'stop')):
+        unit = claim(path)
+
+        if unit is None:
+            time.sleep(poll_interval)
+            continue
+
+        claimed = os.path.join(path, 'claimed', unit)
+
+        # renew the lease while the unit is evaluated
+        evaluating = threading.Event()
+
+        def renew():
+            while not evaluating.wait(lease_time / 3.):
+                try:
+                    os.utime(claimed, None)
+                except OSError:
+                    return
+
+        renewal = threading.Thread(target=renew)
+        renewal.daemon = True
+        renewal.start()
+
+        try:
+            with open(claimed, 'rb') as file_in:
+                func, item = pickle.load(file_in)
+            result = (True, func(item))
+        except Exception as error:
+            result = (False, error)
+        finally:
+            evaluating.set()
+
+        write_atomic(os.path.join(path, 'results', unit), result)
+
+        try:
+            os.remove(claimed)
+        except OSError:
+            # the lease expired and the unit went back to pending/
+            pass
+
+
+def initialized_worker(path, initializer, initargs, lease_time):
+    """
+    Call initializer(*initargs) and run the worker (the target of the local worker processes,
+    defined at the module level so it can be pickled by the spawn and forkserver start methods)
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    worker(path, lease_time=lease_time)
+
+
+def local_workers(path, n_workers, initializer=None, initargs=(), lease_time=FileQueue.lease_time):
+    """
+    Start n_workers local worker processes of the queue in the directory path (a stand-in for the remote nodes)
+    renewing their leases as required by the lease_time of the coordinator
+    """
+    processes = [
+        Process(target=initialized_worker, args=(path, initializer, initargs, lease_time)) for _ in range(n_workers)
+    ]
+
+    for process in processes:
+        process.daemon = True
+        process.start()
+
+    return processes
+
+
+if __name__ == '__main__':
+    worker(sys.argv[1], lease_time=float(sys.argv[2]) if len(sys.argv) > 2 else FileQueue.lease_time)
@@ -0,0 +1,155 @@
+"""
+Gradient based maximization of the population returned by KineticsProp over bounded parameters.
+
+The gradient is obtained by central finite differences; the value and all the displaced points
+are evaluated as a single batch, which is split among the pool workers keeping each pair of the points
+displaced along the same axis in one call (the batched engines choose the time step for the whole call).
+The optimization (L-BFGS-B in the parameters scaled to the unit box) is restarted
+from the best points of a random sample, and every evaluation is logged.
+"""
+import numpy as np
+from scipy.optimize import minimize
+
+
+class YieldOptimizer(object):
+    """
+    Multi-start maximization of a vectorized function over a box
+    """
+
+    # Finite difference step relative to the width of the bounds
+    fd_step = 1e-3
+
+    # Number of the random points from which the best ones are taken as the starting points
+    n_samples = 64
+
+    # Number of the optimization runs
+    n_starts = 4
+
+    # Maximal number of iterations of each optimization run
+    max_iter = 100
+
+    # Seed of the random sample
+    seed = None
+
+    # Number of parts each batch of points is split into for the pool workers
+    n_workers = 4
+
+    def __init__(self, func, bounds, pool=None, **kwargs):
+        """
+               func -- function of an (N, len(bounds)) array of points returning N values (e.g., KineticsProp.batch)
+               bounds -- list of the (min, max) of each parameter
+               pool -- multiprocessing pool to evaluate the batches of points (None means the current process)
+
+         Optional:
+
+               fd_step, n_samples, n_starts, max_iter, seed, n_workers (see the class attributes)
+        """
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+        self.func = func
+        self.pool = pool
+
+        self.lower, self.upper = np.array(bounds, dtype=float).T
+        self.width = self.upper - self.lower
+
+        # log of all the evaluations: points, values and the number of the optimization run (-1 for the sampling)
+        self.points = []
+        self.values = []
+        self.runs = []
+        self.run = -1
+
+    def evaluate(self, points, chunks=None):
+        """
+        Return the values at the points (in the original units) logging them
+
+               chunks -- list of the arrays of the indices of the points evaluated by the same call of func
+                         (by default the points are split evenly among the n_workers calls)
+        """
+        points = np.atleast_2d(points)
+
+        if self.pool is None:
+            values = np.asarray(self.func(points), dtype=float)
+        else:
+            if chunks is None:
+                chunks = np.array_split(np.arange(len(points)), min(len(points), self.n_workers))
+
+            values = np.empty(len(points))
+            for chunk, chunk_values in zip(chunks, self.pool.map(self.func, [points[chunk] for chunk in chunks])):
+                values[chunk] = chunk_values
+
+        self.points.extend(points)
+        self.values.extend(values)
+        self.runs.extend([self.run] * len(values))
+
+        return values
+
+    def value_and_gradient(self, x):
+        """
+        Return the value and its gradient at x in the scaled coordinates [0, 1]
+        (one sided differences at the bounds)
+        """
+        displacement = np.eye(len(x)) * self.fd_step
+
+        forward = np.clip(x + displacement, 0., 1.)
+        backward = np.clip(x - displacement, 0., 1.)
+
+        # both points of each difference are evaluated by the same call of func, i.e., with the same discretization
+        pairs = np.array_split(np.arange(1, len(x) + 1), min(len(x), self.n_workers))
+        chunks = [np.concatenate([pair, pair + len(x)]) for pair in pairs]
+        chunks[0] = np.append(0, chunks[0])
+
+        values = self.evaluate(self.lower + self.width * np.vstack([x, forward, backward]), chunks)
+
+        value = values[0]
+        forward_values, backward_values = values[1:].reshape(2, len(x))
+
+        gradient = (forward_values - backward_values) / (forward - backward).diagonal()
+
+        return value, gradient
+
+    def __call__(self):
+        """
+        Return the best point found and the value at it
+        """
+        rng = np.random.RandomState(self.seed)
+
+        # ===========================================================================#
+        # ---------------------------- MULTI-START SEEDING --------------------------#
+        # ===========================================================================#
+        self.run = -1
+
+        sample = rng.uniform(size=(self.n_samples, len(self.width)))
+        values = self.evaluate(self.lower + self.width * sample)
+
+        starts = sample[np.argsort(values)[::-1][:self.n_starts]]
+
+        # ===========================================================================#
+        # ------------------------------- OPTIMIZATION ------------------------------#
+        # ===========================================================================#
+        self.results = []
+
+        for run, x0 in enumerate(starts):
+            self.run = run
+
+            def objective(x):
+                value, gradient = self.value_and_gradient(x)
+                return -value, -gradient
+
+            self.results.append(minimize(
+                objective, x0, jac=True, method='L-BFGS-B',
+                bounds=[(0., 1.)] * len(x0), options={'maxiter': self.max_iter}
+            ))
+
+        best = int(np.argmax(self.values))
+        return self.points[best], self.values[best]
+
+    def log(self):
+        """
+        Return the log of the evaluations as a dict of arrays
+        """
+        return {
+            'points': np.array(self.points),
+            'values': np.array(self.values),
+            'runs': np.array(self.runs),
+        }